@@ -0,0 +1,221 @@
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first, without sorting the whole array."""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[-1]:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(scores.shape[-1])
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """Row-wise `top_k` over a (queries x rows) score matrix."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(scores, -k, axis=1)[:, -k:]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(np.take_along_axis(scores, candidates, axis=1), axis=1)[:, ::-1]
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def inner_products(matrix, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    (queries x rows) inner products against `matrix`: a float32 embedding array,
+    or a quantised matrix (see quantization.QuantizedMatrix) scored asymmetrically.
+    """
+    if hasattr(matrix, "inner_products"):
+        return matrix.inner_products(queries, rows)
+    return queries @ (matrix if rows is None else matrix[rows]).T
+
+
+class FlatIndex:
+    """Exact inner-product search; the reference every ANN index is measured against."""
+
+    kind = "flat"
+
+    def build(self, embeddings: np.ndarray):
+        pass
+
+    def add(self, embeddings: np.ndarray, start: int):
+        pass
+
+    def search(self, embeddings: np.ndarray, query: np.ndarray, k: int, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+        similarities = inner_products(embeddings, np.asarray(query, dtype=np.float32)[None, :])[0]
+        top_indices = top_k(similarities, k)
+        return top_indices, similarities[top_indices]
+
+    def search_batch(self, embeddings: np.ndarray, queries: np.ndarray, k: int,
+                     block_size: int = 256, **kwargs) -> List[Tuple[np.ndarray, np.ndarray]]:
+        # One matrix-matrix product per block of queries; blocks keep the
+        # (queries x rows) score matrix bounded on large corpora.
+        results = []
+        for start in range(0, queries.shape[0], block_size):
+            similarities = inner_products(embeddings, queries[start:start + block_size])
+            top_indices = top_k_rows(similarities, k)
+            top_scores = np.take_along_axis(similarities, top_indices, axis=1)
+            results.extend(zip(top_indices, top_scores))
+        return results
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {"kind": self.kind}
+
+    def load_state_dict(self, state: Dict[str, Any]):
+        pass
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index: rows are bucketed under their nearest k-means centroid and
+    a query only scores the rows in its `n_probe` closest buckets. Added rows are
+    filed under the existing centroids until the index reaches `retrain_growth`
+    times the rows it was trained on; then it is rebuilt, with more lists if
+    `n_lists` is left to scale with the corpus.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, n_lists: Optional[int] = None, n_probe: int = 8, n_iter: int = 10,
+                 sample_per_list: int = 256, seed: int = 0, retrain_growth: float = 2.0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.sample_per_list = sample_per_list
+        self.seed = seed
+        self.retrain_growth = retrain_growth
+        self.trained_rows = 0
+        self.centroids = None
+        self.list_offsets = None
+        self.list_rows = None
+
+    def build(self, embeddings: np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        n_rows = embeddings.shape[0]
+        n_lists = self.n_lists or max(1, int(np.sqrt(n_rows)))
+        n_lists = min(n_lists, n_rows)
+        self.centroids = self._train_centroids(embeddings, n_lists)
+        self.trained_rows = n_rows
+        self._set_lists(self._assign(embeddings))
+
+    def add(self, embeddings: np.ndarray, start: int):
+        """File rows `start:` under the existing centroids, or rebuild if the index has outgrown its training."""
+        if self.centroids is None or embeddings.shape[0] >= self.retrain_growth * max(self.trained_rows, 1):
+            self.build(embeddings)
+            return
+        assignment = np.empty(start, dtype=np.int64)
+        assignment[self.list_rows] = np.repeat(np.arange(self.centroids.shape[0]), np.diff(self.list_offsets))
+        new_assignment = self._assign(np.asarray(embeddings[start:], dtype=np.float32))
+        self._set_lists(np.concatenate([assignment, new_assignment]))
+
+    def _train_centroids(self, embeddings: np.ndarray, n_lists: int) -> np.ndarray:
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(embeddings.shape[0], n_lists * self.sample_per_list)
+        sample = embeddings[rng.choice(embeddings.shape[0], sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        # Spherical k-means: the vectors are compared by inner product, so the
+        # centroids are kept on the unit sphere as well.
+        for _ in range(self.n_iter):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=n_lists)
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+        return centroids.astype(np.float32)
+
+    def _assign(self, embeddings: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        assignment = np.empty(embeddings.shape[0], dtype=np.int64)
+        for start in range(0, embeddings.shape[0], block_size):
+            block = embeddings[start:start + block_size]
+            assignment[start:start + block_size] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignment
+
+    def _set_lists(self, assignment: np.ndarray):
+        self.list_rows = np.argsort(assignment, kind="stable").astype(np.int64)
+        counts = np.bincount(assignment, minlength=self.centroids.shape[0])
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    def search(self, embeddings: np.ndarray, query: np.ndarray, k: int,
+               n_probe: Optional[int] = None, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+        if self.centroids is None:
+            raise ValueError("IVF index has not been built.")
+        n_probe = min(n_probe or self.n_probe, self.centroids.shape[0])
+        centroid_scores = self.centroids @ np.asarray(query, dtype=np.float32)
+        probed = top_k(centroid_scores, n_probe)
+        candidates = np.concatenate(
+            [self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probed]
+        )
+        similarities = inner_products(embeddings, np.asarray(query, dtype=np.float32)[None, :], candidates)[0]
+        order = top_k(similarities, k)
+        return candidates[order], similarities[order]
+
+    def search_batch(self, embeddings: np.ndarray, queries: np.ndarray, k: int,
+                     n_probe: Optional[int] = None, **kwargs) -> List[Tuple[np.ndarray, np.ndarray]]:
+        # Each query probes its own lists, so only the candidate scoring is per query.
+        return [self.search(embeddings, query, k, n_probe=n_probe) for query in queries]
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "n_lists": self.n_lists,
+            "n_probe": self.n_probe,
+            "n_iter": self.n_iter,
+            "sample_per_list": self.sample_per_list,
+            "seed": self.seed,
+            "retrain_growth": self.retrain_growth,
+            "trained_rows": self.trained_rows,
+            "centroids": self.centroids,
+            "list_offsets": self.list_offsets,
+            "list_rows": self.list_rows,
+        }
+
+    def load_state_dict(self, state: Dict[str, Any]):
+        for key in ("n_lists", "n_probe", "n_iter", "sample_per_list", "seed", "retrain_growth"):
+            setattr(self, key, state[key])
+        self.trained_rows = int(state["trained_rows"])
+        self.centroids = state["centroids"]
+        self.list_offsets = state["list_offsets"]
+        self.list_rows = state["list_rows"]
+
+
+INDEX_TYPES = {
+    FlatIndex.kind: FlatIndex,
+    IVFFlatIndex.kind: IVFFlatIndex,
+}
+
+
+def create_index(kind: str = "flat", **params):
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{kind}'. Expected one of: {', '.join(INDEX_TYPES)}")
+    return INDEX_TYPES[kind](**params)
+
+
+def index_from_state(state: Dict[str, Any]):
+    index = create_index(state["kind"])
+    index.load_state_dict(state)
+    return index
+
+
+def measure_recall(index, embeddings: np.ndarray, queries: np.ndarray, k: int = 20, **search_params) -> float:
+    """Recall@k of `index` against exact brute-force search over the same queries."""
+    exact = FlatIndex()
+    hits = 0
+    total = 0
+    for query in queries:
+        expected, _ = exact.search(embeddings, query, k)
+        found, _ = index.search(embeddings, query, k, **search_params)
+        hits += len(set(expected.tolist()) & set(found.tolist()))
+        total += len(expected)
+    return hits / total if total else 0.0
@@ -0,0 +1,384 @@
+"""
+Offline benchmarks for the retrieval hot paths.
+
+Voyage, Anthropic, Cohere and Elasticsearch are replaced by deterministic local
+stand-ins (a feature-hashing embedder, a templated contextualiser, a stub
+reranker and the in-process BM25 engine), and corpora are generated in the
+codebase_chunks.json shape, so every run is reproducible and needs no
+credentials. Each corpus size runs in a fresh process; every stage reports
+wall time and peak RSS.
+
+    python benchmark.py --chunks 10000 100000 --dim 256 --output benchmark.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from typing import List, Dict, Any, Iterator, Optional
+
+from contextual_vector_db import ContextualVectorDB
+from vector_db import VectorDB
+from rate_limiter import AdaptiveRateLimiter
+from reranking import Reranker
+from bm25 import InMemoryBM25
+from contextual_bm25 import retrieve_advanced, hybrid_retriever
+from evaluation import EvaluationSet
+from evaluation_runner import EvaluationRunner
+
+SCALES = (10_000, 100_000, 1_000_000, 10_000_000)
+STAGES = ("load_data", "save_db", "load_db", "search", "retrieve_advanced", "evaluation")
+
+_SYLLABLES = ("ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "xe", "zu", "bra", "cho", "dre", "fli", "gro", "pla")
+VOCABULARY = [a + b + c for a in _SYLLABLES for b in _SYLLABLES for c in _SYLLABLES]
+
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HashEmbedder:
+    """
+    Stand-in for voyageai.Client: feature-hashed bag of words (each token adds
+    +/-1 to one of `dim` buckets), so texts that share words embed close together.
+    """
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self._buckets = {}
+
+    def _bucket(self, token: str):
+        bucket = self._buckets.get(token)
+        if bucket is None:
+            value = _stable_hash(token)
+            bucket = self._buckets[token] = (value % self.dim, 1.0 if value & (1 << 63) else -1.0)
+        return bucket
+
+    def embed(self, texts: List[str], model: Optional[str] = None, input_type: Optional[str] = None):
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in text.lower().split():
+                column, sign = self._bucket(token)
+                embeddings[row, column] += sign
+        embeddings[np.abs(embeddings).sum(axis=1) == 0, 0] = 1.0
+        return SimpleNamespace(embeddings=embeddings)
+
+
+class TemplatedContextualiser:
+    """
+    Stand-in for anthropic.Anthropic: answers situate_context's request with a
+    context built from a template, and reports prompt-cache usage as the API
+    would (the first request per document writes the cache, later ones read it).
+    """
+
+    def __init__(self):
+        self._seen = set()
+        self._lock = threading.Lock()
+        self.beta = SimpleNamespace(prompt_caching=SimpleNamespace(messages=SimpleNamespace(create=self.create)))
+
+    @staticmethod
+    def context(doc: str, chunk: str) -> str:
+        doc_words = doc.split()[:6]
+        chunk_words = chunk.split()[:4]
+        return f"This chunk belongs to a document about {' '.join(doc_words)} and discusses {' '.join(chunk_words)}."
+
+    def create(self, messages, **kwargs):
+        doc_text, chunk_text = (part["text"] for part in messages[0]["content"])
+        doc = re.search(r"<document>(.*)</document>", doc_text, re.S).group(1).strip()
+        chunk = re.search(r"<chunk>(.*)</chunk>", chunk_text, re.S).group(1).strip()
+        doc_tokens = len(doc_text) // 4
+        with self._lock:
+            warm = doc in self._seen
+            self._seen.add(doc)
+        usage = SimpleNamespace(
+            input_tokens=len(chunk_text) // 4,
+            output_tokens=24,
+            cache_read_input_tokens=doc_tokens if warm else 0,
+            cache_creation_input_tokens=0 if warm else doc_tokens,
+        )
+        return SimpleNamespace(content=[SimpleNamespace(text=self.context(doc, chunk))], usage=usage)
+
+
+class StubReranker(Reranker):
+    """Deterministic reranker: query-word overlap with the chunk, ties broken by a stable hash."""
+
+    def __init__(self, max_candidates: Optional[int] = None, max_concurrency: int = 8):
+        super().__init__(max_candidates=max_candidates, max_concurrency=max_concurrency, cache_size=0)
+
+    def score(self, query: str, candidates: List[Dict[str, Any]]) -> List[float]:
+        words = set(query.lower().split())
+        return [
+            len(words.intersection(result['metadata']['original_content'].lower().split()))
+            + (_stable_hash(f"{query}\x1f{result['metadata']['chunk_id']}") % 1000) / 1e4
+            for result in candidates
+        ]
+
+
+def synthetic_document(doc_number: int, n_chunks: int, chunks_per_doc: int = 8, words_per_chunk: int = 60,
+                       seed: int = 0) -> Dict[str, Any]:
+    """One document in the codebase_chunks.json shape, a pure function of (seed, document number)."""
+    rng = np.random.default_rng([seed, doc_number])
+    n_doc_chunks = min(chunks_per_doc, n_chunks - doc_number * chunks_per_doc)
+    # Zipfian word frequencies, like natural text and code identifiers.
+    word_ids = (rng.zipf(1.3, size=(n_doc_chunks, words_per_chunk)) - 1) % len(VOCABULARY)
+    chunks = [" ".join(VOCABULARY[word] for word in row) for row in word_ids]
+    doc_id = f"doc_{doc_number}"
+    return {
+        "doc_id": doc_id,
+        "original_uuid": f"{_stable_hash(doc_id):016x}",
+        "source": f"repo-{doc_number % 97}",
+        "file_path": f"src/module_{doc_number % 1013}/file_{doc_number}.py",
+        "content": "\n\n".join(chunks),
+        "chunks": [
+            {"chunk_id": f"{doc_id}_chunk_{index}", "original_index": index, "content": content}
+            for index, content in enumerate(chunks)
+        ],
+    }
+
+
+def synthetic_corpus(n_chunks: int, chunks_per_doc: int = 8, words_per_chunk: int = 60, seed: int = 0,
+                     start_chunk: int = 0) -> Iterator[Dict[str, Any]]:
+    """Documents holding `n_chunks` chunks in total, from the document containing `start_chunk` onwards."""
+    n_docs = -(-n_chunks // chunks_per_doc)
+    for doc_number in range(start_chunk // chunks_per_doc, n_docs):
+        yield synthetic_document(doc_number, n_chunks, chunks_per_doc, words_per_chunk, seed)
+
+
+def synthetic_evaluation_set(n_chunks: int, n_queries: int, chunks_per_doc: int = 8, words_per_chunk: int = 60,
+                             words_per_query: int = 8, seed: int = 0) -> List[Dict[str, Any]]:
+    """Queries made of words sampled from one chunk each, in the evaluation_set.jsonl shape."""
+    rng = np.random.default_rng([seed, 1 << 32])
+    n_docs = -(-n_chunks // chunks_per_doc)
+    items = []
+    for doc_number in sorted(rng.choice(n_docs, size=min(n_queries, n_docs), replace=False).tolist()):
+        doc = synthetic_document(doc_number, n_chunks, chunks_per_doc, words_per_chunk, seed)
+        chunk = doc["chunks"][int(rng.integers(len(doc["chunks"])))]
+        words = chunk["content"].split()
+        positions = rng.choice(len(words), size=min(words_per_query, len(words)), replace=False)
+        items.append({
+            "query": " ".join(words[int(position)] for position in positions),
+            "golden_chunk_uuids": [[doc["original_uuid"], chunk["original_index"]]],
+            "golden_documents": [{
+                "uuid": doc["original_uuid"],
+                "content": doc["content"],
+                "chunks": [{"index": c["original_index"], "content": c["content"]} for c in doc["chunks"]],
+            }],
+        })
+    return items
+
+
+def _reset_peak_rss():
+    # Linux resets the VmHWM high-water mark when "5" is written to clear_refs.
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Lifetime peak in KiB on Linux (bytes on macOS); used where VmHWM is unavailable.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _latency_ms(latencies: List[float]) -> Dict[str, float]:
+    values = np.asarray(latencies) * 1000
+    return {"mean": float(values.mean()), "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)), "p99": float(np.percentile(values, 99))}
+
+
+class StageRecorder:
+    def __init__(self):
+        self.stages = {}
+
+    def measure(self, name: str, fn, *args, **kwargs):
+        _reset_peak_rss()
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        self.stages[name] = {"seconds": seconds, "peak_rss_mb": _peak_rss_mb()}
+        print(f"[benchmark] {name}: {seconds:.2f} s, peak RSS {self.stages[name]['peak_rss_mb']:.0f} MB")
+        return result
+
+
+DATABASES = {"contextual": ContextualVectorDB, "vector": VectorDB}
+
+
+def _new_db(name: str, dim: int, index_type: str, quantization: Optional[str] = None,
+            database: str = "contextual") -> VectorDB:
+    if database == "vector":
+        return VectorDB(name, index_type=index_type, quantization=quantization, voyage_client=HashEmbedder(dim))
+    return ContextualVectorDB(
+        name,
+        index_type=index_type,
+        quantization=quantization,
+        voyage_client=HashEmbedder(dim),
+        anthropic_client=TemplatedContextualiser(),
+        rate_limiter=AdaptiveRateLimiter(requests_per_minute=1e12, tokens_per_minute=1e15,
+                                         max_concurrency=32, initial_concurrency=32),
+        context_cache_path=None,
+    )
+
+
+def _bulk_append(db: VectorDB, n_chunks: int, start_chunk: int, chunks_per_doc: int, seed: int,
+                 batch_chunks: int = 100_000):
+    # Chunks past the ingest limit skip the per-chunk pipeline (threads, journal
+    # fsyncs) and are contextualised (ContextualVectorDB only), embedded and
+    # appended in large batches.
+    contextualiser = TemplatedContextualiser() if isinstance(db, ContextualVectorDB) else None
+    texts, metadata = [], []
+
+    def flush():
+        db._append_rows(db.voyage_client.embed(texts).embeddings, list(metadata))
+        texts.clear()
+        metadata.clear()
+
+    for doc in synthetic_corpus(n_chunks, chunks_per_doc, seed=seed, start_chunk=start_chunk):
+        for chunk in doc["chunks"]:
+            context = contextualiser.context(doc["content"], chunk["content"]) if contextualiser else None
+            result = db._chunk_result(doc, chunk, context)
+            texts.append(result["text_to_embed"])
+            metadata.append(result["metadata"])
+        if len(texts) >= batch_chunks:
+            flush()
+    if texts:
+        flush()
+
+
+def run_scale(n_chunks: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Benchmark one corpus size inside the current working directory."""
+    stages = options["stages"]
+    chunks_per_doc = options["chunks_per_doc"]
+    seed = options["seed"]
+    recorder = StageRecorder()
+    report = {"chunks": n_chunks, "stages": recorder.stages}
+
+    db = _new_db("benchmark", options["dim"], options["index_type"], options["quantization"], options["database"])
+    ingest_chunks = min(n_chunks, options["ingest_limit"])
+    ingest_chunks -= ingest_chunks % chunks_per_doc if ingest_chunks < n_chunks else 0
+    dataset = list(synthetic_corpus(ingest_chunks, chunks_per_doc, seed=seed))
+    recorder.measure("load_data", db.load_data, dataset)
+    del dataset
+    if ingest_chunks < n_chunks:
+        recorder.measure("bulk_append", _bulk_append, db, n_chunks, ingest_chunks, chunks_per_doc, seed)
+    report["ingested_chunks"] = ingest_chunks
+
+    if "save_db" in stages:
+        recorder.measure("save_db", db.save_db)
+    if "load_db" in stages:
+        db.save_db()
+        db = _new_db("benchmark", options["dim"], options["index_type"], options["quantization"], options["database"])
+        recorder.measure("load_db", db.load_db)
+
+    evaluation_items = synthetic_evaluation_set(n_chunks, options["queries"], chunks_per_doc, seed=seed)
+    queries = [item["query"] for item in evaluation_items]
+
+    if "search" in stages:
+        def search_all():
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                db.search(query, k=20)
+                latencies.append(time.perf_counter() - start)
+            return latencies
+        report["search_latency_ms"] = _latency_ms(recorder.measure("search", search_all))
+
+    bm25 = None
+    if "retrieve_advanced" in stages or "evaluation" in stages:
+        bm25 = InMemoryBM25()
+        recorder.measure("bm25_index", bm25.index_documents, db.metadata)
+
+    if "retrieve_advanced" in stages:
+        fusion = hybrid_retriever(db, bm25)
+
+        def retrieve_all():
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                retrieve_advanced(query, db, bm25, 20, fusion=fusion)
+                latencies.append(time.perf_counter() - start)
+            return latencies
+        report["retrieve_advanced_latency_ms"] = _latency_ms(recorder.measure("retrieve_advanced", retrieve_all))
+
+    if "evaluation" in stages:
+        runner = EvaluationRunner(db, bm25=bm25, reranker=StubReranker(), max_workers=options["workers"], warmup=0)
+        evaluation = recorder.measure("evaluation", runner.run, EvaluationSet(evaluation_items))
+        report["evaluation"] = {
+            "metrics": evaluation["metrics"],
+            "latency_ms": evaluation["latency_ms"],
+            "throughput_qps": evaluation["throughput_qps"],
+        }
+    return report
+
+
+def _run_scale_in_directory(n_chunks: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix=f"rag-benchmark-{n_chunks}-", dir=options["workdir"])
+    os.chdir(workdir)
+    try:
+        return run_scale(n_chunks, options)
+    finally:
+        os.chdir(os.path.dirname(workdir))
+        if not options["keep"]:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=list(SCALES[:2]),
+                        help=f"corpus sizes to benchmark (suggested: {', '.join(str(s) for s in SCALES)})")
+    parser.add_argument("--dim", type=int, default=1024, help="embedding dimension (voyage-2 is 1024)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--chunks-per-doc", type=int, default=8)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--quantization", default=None, choices=("int8", "pq"))
+    parser.add_argument("--database", default="contextual", choices=tuple(DATABASES),
+                        help="ContextualVectorDB, or VectorDB without contextualisation")
+    parser.add_argument("--ingest-limit", type=int, default=100_000,
+                        help="chunks ingested through load_data; the rest are bulk-appended")
+    parser.add_argument("--workers", type=int, default=8, help="evaluation worker threads")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="where databases are written (default: system temp)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated databases")
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    options = {
+        "dim": args.dim, "queries": args.queries, "chunks_per_doc": args.chunks_per_doc,
+        "index_type": args.index_type, "quantization": args.quantization, "database": args.database, "ingest_limit": args.ingest_limit, "workers": args.workers,
+        "stages": args.stages, "seed": args.seed, "workdir": args.workdir, "keep": args.keep,
+    }
+    reports = []
+    for n_chunks in args.chunks:
+        # A fresh process per size, so peak RSS and caches don't carry over.
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            reports.append(executor.submit(_run_scale_in_directory, n_chunks, options).result())
+
+    report = {"options": options, "results": reports}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+        print(f"Wrote benchmark report to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
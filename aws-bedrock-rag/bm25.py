@@ -0,0 +1,290 @@
+import re
+import numpy as np
+from collections import Counter
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
+
+# Lucene's English stop set, as used by Elasticsearch's `english` analyzer.
+ENGLISH_STOPWORDS = frozenset("""
+a an and are as at be but by for if in into is it no not of on or such that the their then there these
+they this to was will with
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+class PorterStemmer:
+    """The original Porter (1980) stemming algorithm."""
+
+    @staticmethod
+    def _cons(word: str, i: int) -> bool:
+        ch = word[i]
+        if ch in "aeiou":
+            return False
+        if ch == "y":
+            return i == 0 or not PorterStemmer._cons(word, i - 1)
+        return True
+
+    @classmethod
+    def _measure(cls, stem: str) -> int:
+        # Number of VC sequences in [C](VC)^m[V].
+        m = 0
+        prev_vowel = False
+        for i in range(len(stem)):
+            vowel = not cls._cons(stem, i)
+            if prev_vowel and not vowel:
+                m += 1
+            prev_vowel = vowel
+        return m
+
+    @classmethod
+    def _has_vowel(cls, stem: str) -> bool:
+        return any(not cls._cons(stem, i) for i in range(len(stem)))
+
+    @classmethod
+    def _double_cons(cls, word: str) -> bool:
+        return len(word) >= 2 and word[-1] == word[-2] and cls._cons(word, len(word) - 1)
+
+    @classmethod
+    def _cvc(cls, word: str) -> bool:
+        if len(word) < 3:
+            return False
+        return (cls._cons(word, len(word) - 3) and not cls._cons(word, len(word) - 2)
+                and cls._cons(word, len(word) - 1) and word[-1] not in "wxy")
+
+    @classmethod
+    def _replace(cls, word: str, rules, min_measure: int) -> str:
+        for suffix, replacement in rules:
+            if word.endswith(suffix):
+                stem = word[:len(word) - len(suffix)]
+                if cls._measure(stem) > min_measure:
+                    return stem + replacement
+                return word
+        return word
+
+    _STEP2 = (
+        ("ational", "ate"), ("tional", "tion"), ("enci", "ence"), ("anci", "ance"), ("izer", "ize"),
+        ("abli", "able"), ("alli", "al"), ("entli", "ent"), ("eli", "e"), ("ousli", "ous"),
+        ("ization", "ize"), ("ation", "ate"), ("ator", "ate"), ("alism", "al"), ("iveness", "ive"),
+        ("fulness", "ful"), ("ousness", "ous"), ("aliti", "al"), ("iviti", "ive"), ("biliti", "ble"),
+    )
+    _STEP3 = (
+        ("icate", "ic"), ("ative", ""), ("alize", "al"), ("iciti", "ic"), ("ical", "ic"), ("ful", ""), ("ness", ""),
+    )
+    _STEP4 = (
+        "al", "ance", "ence", "er", "ic", "able", "ible", "ant", "ement", "ment", "ent", "ion", "ou", "ism",
+        "ate", "iti", "ous", "ive", "ize",
+    )
+
+    @classmethod
+    def stem(cls, word: str) -> str:
+        if len(word) <= 2:
+            return word
+
+        # Step 1a
+        if word.endswith("sses"):
+            word = word[:-2]
+        elif word.endswith("ies"):
+            word = word[:-2]
+        elif word.endswith("ss"):
+            pass
+        elif word.endswith("s"):
+            word = word[:-1]
+
+        # Step 1b
+        extra = False
+        if word.endswith("eed"):
+            if cls._measure(word[:-3]) > 0:
+                word = word[:-1]
+        elif word.endswith("ed") and cls._has_vowel(word[:-2]):
+            word = word[:-2]
+            extra = True
+        elif word.endswith("ing") and cls._has_vowel(word[:-3]):
+            word = word[:-3]
+            extra = True
+        if extra:
+            if word.endswith(("at", "bl", "iz")):
+                word += "e"
+            elif cls._double_cons(word) and word[-1] not in "lsz":
+                word = word[:-1]
+            elif cls._measure(word) == 1 and cls._cvc(word):
+                word += "e"
+
+        # Step 1c
+        if word.endswith("y") and cls._has_vowel(word[:-1]):
+            word = word[:-1] + "i"
+
+        # Steps 2 and 3
+        word = cls._replace(word, cls._STEP2, 0)
+        word = cls._replace(word, cls._STEP3, 0)
+
+        # Step 4
+        for suffix in cls._STEP4:
+            if word.endswith(suffix):
+                stem = word[:len(word) - len(suffix)]
+                if cls._measure(stem) > 1 and (suffix != "ion" or stem.endswith(("s", "t"))):
+                    word = stem
+                break
+
+        # Step 5
+        if word.endswith("e"):
+            stem = word[:-1]
+            m = cls._measure(stem)
+            if m > 1 or (m == 1 and not cls._cvc(stem)):
+                word = stem
+        if cls._measure(word) > 1 and cls._double_cons(word) and word.endswith("l"):
+            word = word[:-1]
+        return word
+
+
+@lru_cache(maxsize=200_000)
+def _stem(token: str) -> str:
+    return PorterStemmer.stem(token)
+
+
+def analyze(text: str) -> List[str]:
+    """English analysis: lowercase, split, strip possessives, drop stopwords, Porter-stem."""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token.endswith("'s"):
+            token = token[:-2]
+        else:
+            token = token.replace("'", "")
+        if token and token not in ENGLISH_STOPWORDS:
+            terms.append(_stem(token))
+    return terms
+
+
+class InMemoryBM25:
+    """
+    In-process BM25 with the same `index_documents`/`search` interface as
+    ElasticsearchBM25. Each field has its own CSR inverted index (term -> sorted
+    doc ids and term frequencies); like a `multi_match` best_fields query, a
+    document scores as its best boosted field. Top-k uses MaxScore pruning, so
+    only documents containing at least one "essential" query term are scored.
+    """
+
+    FIELDS = {"content": "original_content", "contextualized_content": "contextualized_content"}
+
+    def __init__(self, field_boosts: Optional[Dict[str, float]] = None, k1: float = 1.2, b: float = 0.75):
+        self.field_boosts = {field: 1.0 for field in self.FIELDS}
+        self.field_boosts.update(field_boosts or {})
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}
+        self.documents = []
+        self._postings = {field: ([], [], []) for field in self.FIELDS}
+        self._doc_lengths = {field: [] for field in self.FIELDS}
+        self._index = {}
+
+    def index_documents(self, documents: List[Dict[str, Any]]) -> int:
+        for doc in documents:
+            doc_number = len(self.documents)
+            self.documents.append({
+                "doc_id": doc["doc_id"],
+                "original_index": doc["original_index"],
+                "content": doc["original_content"],
+                "contextualized_content": doc.get("contextualized_content", ""),
+            })
+            for field, source in self.FIELDS.items():
+                counts = Counter(analyze(doc.get(source, "")))
+                term_ids, doc_numbers, tfs = self._postings[field]
+                for term, tf in counts.items():
+                    term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                    doc_numbers.append(doc_number)
+                    tfs.append(tf)
+                self._doc_lengths[field].append(sum(counts.values()))
+        self._build()
+        return len(documents)
+
+    def _build(self):
+        n_terms = len(self.vocabulary)
+        n_docs = len(self.documents)
+        for field in self.FIELDS:
+            term_ids, doc_numbers, tfs = (np.asarray(values) for values in self._postings[field])
+            order = np.lexsort((doc_numbers, term_ids))
+            term_ids = term_ids[order].astype(np.int64)
+            doc_numbers = doc_numbers[order].astype(np.int32)
+            tfs = tfs[order].astype(np.float32)
+            indptr = np.concatenate(([0], np.cumsum(np.bincount(term_ids, minlength=n_terms)))).astype(np.int64)
+
+            doc_lengths = np.asarray(self._doc_lengths[field], dtype=np.float32)
+            avgdl = float(doc_lengths.mean()) if n_docs and doc_lengths.mean() > 0 else 1.0
+            df = np.diff(indptr).astype(np.float32)
+            idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+            norms = (self.k1 * (1 - self.b + self.b * doc_lengths / avgdl)).astype(np.float32)
+            # Per-posting BM25 weight is precomputed once at index time.
+            weights = idf[term_ids] * tfs * (self.k1 + 1) / (tfs + norms[doc_numbers]) * self.field_boosts[field]
+            max_weights = np.zeros(n_terms, dtype=np.float32)
+            np.maximum.at(max_weights, term_ids, weights)
+            self._index[field] = {"indptr": indptr, "docs": doc_numbers, "weights": weights.astype(np.float32),
+                                  "max_weights": max_weights}
+
+    def _postings_of(self, field: str, term_id: int):
+        index = self._index[field]
+        start, end = index["indptr"][term_id], index["indptr"][term_id + 1]
+        return index["docs"][start:end], index["weights"][start:end]
+
+    def _score(self, candidates: np.ndarray, query_terms: Dict[int, int]) -> np.ndarray:
+        best = np.zeros(candidates.shape[0], dtype=np.float32)
+        for field in self.FIELDS:
+            field_scores = np.zeros(candidates.shape[0], dtype=np.float32)
+            for term_id, query_tf in query_terms.items():
+                docs, weights = self._postings_of(field, term_id)
+                if docs.shape[0] == 0:
+                    continue
+                positions = np.minimum(np.searchsorted(docs, candidates), docs.shape[0] - 1)
+                found = docs[positions] == candidates
+                field_scores[found] += query_tf * weights[positions[found]]
+            np.maximum(best, field_scores, out=best)
+        return best
+
+    def _term_docs(self, term_ids) -> np.ndarray:
+        parts = [self._postings_of(field, term_id)[0] for term_id in term_ids for field in self.FIELDS]
+        return np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int32)
+
+    def search(self, query: str, k: int = 20) -> List[Dict[str, Any]]:
+        query_terms = Counter(self.vocabulary[term] for term in analyze(query) if term in self.vocabulary)
+        if not query_terms or k <= 0:
+            return []
+
+        # Upper bound of each term's contribution to any document's score.
+        upper_bounds = {
+            term_id: query_tf * max(self._index[field]["max_weights"][term_id] for field in self.FIELDS)
+            for term_id, query_tf in query_terms.items()
+        }
+        terms = sorted(upper_bounds, key=upper_bounds.get, reverse=True)
+
+        # Seed the threshold by exactly scoring the documents of the strongest terms.
+        seed_terms = []
+        candidates = np.empty(0, dtype=np.int32)
+        for term_id in terms:
+            seed_terms.append(term_id)
+            candidates = self._term_docs(seed_terms)
+            if candidates.shape[0] >= k:
+                break
+        scores = self._score(candidates, query_terms)
+        threshold = np.partition(scores, -k)[-k] if scores.shape[0] >= k else 0.0
+
+        # MaxScore: the weakest terms whose bounds sum below the threshold are
+        # non-essential; a document matching only those can never reach the top k.
+        essential = list(terms)
+        remaining_bound = 0.0
+        while essential and remaining_bound + upper_bounds[essential[-1]] < threshold:
+            remaining_bound += upper_bounds[essential.pop()]
+        extra = np.setdiff1d(self._term_docs(essential), candidates, assume_unique=True)
+        if extra.shape[0]:
+            candidates = np.concatenate([candidates, extra])
+            scores = np.concatenate([scores, self._score(extra, query_terms)])
+
+        top = np.argsort(-scores, kind="stable")[:k]
+        results = []
+        for position in top:
+            if scores[position] <= 0:
+                break
+            doc = self.documents[candidates[position]]
+            results.append({**doc, "score": float(scores[position])})
+        return results
+
+    def search_many(self, queries: List[str], k: int = 20) -> List[List[Dict[str, Any]]]:
+        return [self.search(query, k) for query in queries]
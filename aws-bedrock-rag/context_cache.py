@@ -0,0 +1,75 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import namedtuple
+from typing import Dict, Any, Optional, Tuple
+
+# Same attribute names as the Anthropic usage object, so callers can treat both alike.
+ContextUsage = namedtuple(
+    "ContextUsage", ["input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"]
+)
+NO_USAGE = ContextUsage(0, 0, 0, 0)
+
+
+def context_key(model: str, prompt_template: str, doc: str, chunk: str) -> str:
+    digest = hashlib.sha256()
+    for part in (model, prompt_template, doc, chunk):
+        encoded = part.encode("utf-8")
+        # Length-prefix each part so different splits can never collide.
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class ContextCache:
+    """
+    Content-addressed store of generated chunk contexts, keyed by
+    hash(model, prompt template, document, chunk). It does not depend on the
+    database name or embedding model, so rebuilding an index only pays for the
+    chunks whose inputs actually changed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS contexts (key TEXT PRIMARY KEY, context TEXT NOT NULL, usage TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+
+    def get(self, key: str) -> Optional[Tuple[str, ContextUsage]]:
+        with self._lock:
+            row = self._conn.execute("SELECT context, usage FROM contexts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            usage = ContextUsage(**json.loads(row[1]))
+            self.hits += 1
+            self.tokens_saved += (
+                usage.input_tokens + usage.output_tokens + usage.cache_read_input_tokens + usage.cache_creation_input_tokens
+            )
+            return row[0], usage
+
+    def put(self, key: str, context: str, usage):
+        usage = ContextUsage(*(int(getattr(usage, field) or 0) for field in ContextUsage._fields))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO contexts (key, context, usage) VALUES (?, ?, ?)",
+                (key, context, json.dumps(usage._asdict())),
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "tokens_saved": self.tokens_saved}
+
+    def close(self):
+        self._conn.close()
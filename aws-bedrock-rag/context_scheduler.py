@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+
+class DocumentScheduler:
+    """
+    Runs per-chunk contextualisation grouped by document. The first chunk of each
+    document runs alone so that its request writes the document's prompt-cache
+    entry; the remaining chunks then fan out and read it. At most
+    `max_docs_in_flight` documents are active at once, which keeps each
+    document's chunks close together in time and inside the cache TTL.
+    """
+
+    def __init__(self, parallel_threads: int, max_docs_in_flight: int = 8):
+        self.parallel_threads = parallel_threads
+        self.max_docs_in_flight = max_docs_in_flight
+
+    @staticmethod
+    def group_by_document(pending: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        groups = {}
+        for doc, chunk in pending:
+            groups.setdefault(doc['doc_id'], (doc, []))[1].append(chunk)
+        return list(groups.values())
+
+    def run(self, pending: List[Tuple[Dict[str, Any], Dict[str, Any]]], fn: Callable[[Dict[str, Any], Dict[str, Any]], Any],
+            on_chunk_done: Optional[Callable[[], None]] = None):
+        def run_chunk(doc, chunk):
+            fn(doc, chunk)
+            if on_chunk_done is not None:
+                on_chunk_done()
+
+        with ThreadPoolExecutor(max_workers=self.parallel_threads) as chunk_pool, \
+                ThreadPoolExecutor(max_workers=self.max_docs_in_flight) as doc_pool:
+            def run_document(doc, chunks):
+                run_chunk(doc, chunks[0])
+                for future in [chunk_pool.submit(run_chunk, doc, chunk) for chunk in chunks[1:]]:
+                    future.result()
+
+            doc_futures = [doc_pool.submit(run_document, doc, chunks) for doc, chunks in self.group_by_document(pending)]
+            try:
+                for future in as_completed(doc_futures):
+                    future.result()
+            except BaseException:
+                # Don't start documents that have not been warmed yet.
+                doc_pool.shutdown(wait=False, cancel_futures=True)
+                raise
@@ -1,14 +1,31 @@
 import os
 import json
-from typing import List, Dict, Any
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Union
 from tqdm import tqdm
 from elasticsearch import Elasticsearch
 from elasticsearch.helpers import bulk
+from bm25 import InMemoryBM25
+from contextual_vector_db import ContextualVectorDB
+from fusion import FusionRetriever, dense_retriever, bm25_retriever
+from evaluation import DEFAULT_KS, EvaluationSet, print_results, single_or_all
 
 class ElasticsearchBM25:
-    def __init__(self, index_name: str = "contextual_bm25_index"):
+    """
+    BM25 over an Elasticsearch index, used in indexing sessions. Periodic
+    refreshes are disabled, so writes only become searchable when the index is
+    refreshed at the end of a bulk load (or on an explicit `refresh`), which
+    bumps `generation`. Searches never refresh; they run against the current
+    generation and are pinned to it via `preference`, so repeated queries hit the
+    same shard copies and their request/query caches.
+    """
+
+    def __init__(self, index_name: str = "contextual_bm25_index", query_cache_enabled: bool = True):
         self.es_client = Elasticsearch("http://localhost:9200")
         self.index_name = index_name
+        self.query_cache_enabled = query_cache_enabled
+        self.generation = 0
         self.create_index()
 
     def create_index(self):
@@ -16,7 +33,8 @@ class ElasticsearchBM25:
             "settings": {
                 "analysis": {"analyzer": {"default": {"type": "english"}}},
                 "similarity": {"default": {"type": "BM25"}},
-                "index.queries.cache.enabled": False  # Disable query cache
+                "index.queries.cache.enabled": self.query_cache_enabled,
+                "index.refresh_interval": "-1",
             },
             "mappings": {
                 "properties": {
@@ -32,13 +50,32 @@ class ElasticsearchBM25:
             self.es_client.indices.create(index=self.index_name, body=index_settings)
             print(f"Created index: {self.index_name}")
 
+    @contextmanager
+    def indexing_session(self):
+        """
+        Bulk load, then publish the writes as one new generation. Periodic refreshes
+        stay off afterwards (indexes created before they were disabled are switched
+        over here), so `refresh` is the only way new writes become searchable.
+        """
+        self.es_client.indices.put_settings(index=self.index_name, body={"index": {"refresh_interval": "-1"}})
+        try:
+            yield self
+        finally:
+            self.refresh()
+
+    def refresh(self) -> int:
+        """Make everything indexed so far searchable and start a new generation."""
+        self.es_client.indices.refresh(index=self.index_name)
+        self.generation += 1
+        return self.generation
+
     def index_documents(self, documents: List[Dict[str, Any]]):
         actions = [
             {
                 "_index": self.index_name,
                 "_source": {
                     "content": doc["original_content"],
-                    "contextualized_content": doc["contextualized_content"],
+                    "contextualized_content": doc.get("contextualized_content", ""),
                     "doc_id": doc["doc_id"],
                     "chunk_id": doc["chunk_id"],
                     "original_index": doc["original_index"],
@@ -46,13 +83,12 @@ class ElasticsearchBM25:
             }
             for doc in documents
         ]
-        success, _ = bulk(self.es_client, actions)
-        self.es_client.indices.refresh(index=self.index_name)
+        with self.indexing_session():
+            success, _ = bulk(self.es_client, actions, refresh=False)
         return success
 
-    def search(self, query: str, k: int = 20) -> List[Dict[str, Any]]:
-        self.es_client.indices.refresh(index=self.index_name)  # Force refresh before each search
-        search_body = {
+    def _search_body(self, query: str, k: int) -> Dict[str, Any]:
+        return {
             "query": {
                 "multi_match": {
                     "query": query,
@@ -61,7 +97,9 @@ class ElasticsearchBM25:
             },
             "size": k,
         }
-        response = self.es_client.search(index=self.index_name, body=search_body)
+
+    @staticmethod
+    def _format_hits(response: Dict[str, Any]) -> List[Dict[str, Any]]:
         return [
             {
                 "doc_id": hit["_source"]["doc_id"],
@@ -72,60 +110,96 @@ class ElasticsearchBM25:
             }
             for hit in response["hits"]["hits"]
         ]
+
+    def search(self, query: str, k: int = 20) -> List[Dict[str, Any]]:
+        response = self.es_client.search(
+            index=self.index_name, body=self._search_body(query, k), preference=f"generation-{self.generation}"
+        )
+        return self._format_hits(response)
+
+    def search_many(self, queries: List[str], k: int = 20, batch_size: int = 100) -> List[List[Dict[str, Any]]]:
+        """Run many queries through the _msearch API, `batch_size` queries per request."""
+        results = []
+        for i in range(0, len(queries), batch_size):
+            body = []
+            for query in queries[i : i + batch_size]:
+                body.append({"index": self.index_name, "preference": f"generation-{self.generation}"})
+                body.append(self._search_body(query, k))
+            response = self.es_client.msearch(body=body)
+            for item in response["responses"]:
+                if "error" in item:
+                    raise RuntimeError(f"Elasticsearch msearch failed: {item['error']}")
+                results.append(self._format_hits(item))
+        return results
     
 def create_elasticsearch_bm25_index(db: ContextualVectorDB):
     es_bm25 = ElasticsearchBM25()
     es_bm25.index_documents(db.metadata)
     return es_bm25
 
-def retrieve_advanced(query: str, db: ContextualVectorDB, es_bm25: ElasticsearchBM25, k: int, semantic_weight: float = 0.8, bm25_weight: float = 0.2):
-    num_chunks_to_recall = 150
-
-    # Semantic search
-    semantic_results = db.search(query, k=num_chunks_to_recall)
-    ranked_chunk_ids = [(result['metadata']['doc_id'], result['metadata']['original_index']) for result in semantic_results]
-
-    # BM25 search using Elasticsearch
-    bm25_results = es_bm25.search(query, k=num_chunks_to_recall)
-    ranked_bm25_chunk_ids = [(result['doc_id'], result['original_index']) for result in bm25_results]
-
-    # Combine results
-    chunk_ids = list(set(ranked_chunk_ids + ranked_bm25_chunk_ids))
-    chunk_id_to_score = {}
-
-    # Initial scoring with weights
-    for chunk_id in chunk_ids:
-        score = 0
-        if chunk_id in ranked_chunk_ids:
-            index = ranked_chunk_ids.index(chunk_id)
-            score += semantic_weight * (1 / (index + 1))  # Weighted 1/n scoring for semantic
-        if chunk_id in ranked_bm25_chunk_ids:
-            index = ranked_bm25_chunk_ids.index(chunk_id)
-            score += bm25_weight * (1 / (index + 1))  # Weighted 1/n scoring for BM25
-        chunk_id_to_score[chunk_id] = score
-
-    # Sort chunk IDs by their scores in descending order
-    sorted_chunk_ids = sorted(
-        chunk_id_to_score.keys(), key=lambda x: (chunk_id_to_score[x], x[0], x[1]), reverse=True
+def create_bm25_index(db: ContextualVectorDB, backend: str = "elasticsearch"):
+    """Build the lexical index over the database's chunks: "elasticsearch" or in-process "memory"."""
+    if backend == "memory":
+        bm25 = InMemoryBM25()
+        bm25.index_documents(db.metadata)
+        return bm25
+    return create_elasticsearch_bm25_index(db)
+
+def hybrid_retriever(db: ContextualVectorDB, es_bm25: Union[ElasticsearchBM25, InMemoryBM25], semantic_weight: float = 0.8, bm25_weight: float = 0.2,
+                     semantic_depth: int = 150, bm25_depth: int = 150, fusion_method: str = "rrf", rrf_k: float = 0,
+                     semantic_timeout: Optional[float] = None, bm25_timeout: Optional[float] = None) -> FusionRetriever:
+    """
+    Dense + BM25 fusion. Both searches run concurrently; if one misses its
+    timeout, the other's results are returned alone. The defaults (RRF with k=0)
+    reproduce the original weighted 1/rank scoring.
+    """
+    return FusionRetriever(
+        [dense_retriever(db, semantic_depth, semantic_weight, "semantic", semantic_timeout),
+         bm25_retriever(es_bm25, bm25_depth, bm25_weight, "bm25", bm25_timeout)],
+        method=fusion_method,
+        rrf_k=rrf_k,
     )
 
-    # Assign new scores based on the sorted order
-    for index, chunk_id in enumerate(sorted_chunk_ids):
-        chunk_id_to_score[chunk_id] = 1 / (index + 1)
+_default_fusions = {}
+_default_fusion_lock = threading.Lock()
+
+def _default_fusion(db: ContextualVectorDB, es_bm25: Union[ElasticsearchBM25, InMemoryBM25],
+                    semantic_weight: float, bm25_weight: float) -> FusionRetriever:
+    # Shared per (db, index, weights) so repeated calls reuse the retrievers' thread pools.
+    key = (db, es_bm25, semantic_weight, bm25_weight)
+    with _default_fusion_lock:
+        if key not in _default_fusions:
+            _default_fusions[key] = hybrid_retriever(db, es_bm25, semantic_weight, bm25_weight)
+        return _default_fusions[key]
 
-    # Prepare the final results
+def retrieve_advanced(query: str, db: ContextualVectorDB, es_bm25: Union[ElasticsearchBM25, InMemoryBM25], k: int, semantic_weight: float = 0.8, bm25_weight: float = 0.2,
+                      semantic_results: Optional[List[Dict[str, Any]]] = None, bm25_results: Optional[List[Dict[str, Any]]] = None,
+                      fusion: Optional[FusionRetriever] = None):
+    if fusion is None:
+        fusion = _default_fusion(db, es_bm25, semantic_weight, bm25_weight)
+
+    # Sources the caller already ran as part of a batch are not searched again;
+    # the rest run concurrently, each at its own recall depth
+    precomputed = {}
+    if semantic_results is not None:
+        precomputed['semantic'] = semantic_results
+    if bm25_results is not None:
+        precomputed['bm25'] = bm25_results
+    fused = fusion.retrieve(query, k, precomputed=precomputed)
+
+    # Prepare the final results, scored by their position in the fused order
     final_results = []
     semantic_count = 0
     bm25_count = 0
-    for chunk_id in sorted_chunk_ids[:k]:
-        chunk_metadata = next(chunk for chunk in db.metadata if chunk['doc_id'] == chunk_id[0] and chunk['original_index'] == chunk_id[1])
-        is_from_semantic = chunk_id in ranked_chunk_ids
-        is_from_bm25 = chunk_id in ranked_bm25_chunk_ids
+    for index, entry in enumerate(fused):
+        is_from_semantic = 'semantic' in entry['sources']
+        is_from_bm25 = 'bm25' in entry['sources']
         final_results.append({
-            'chunk': chunk_metadata,
-            'score': chunk_id_to_score[chunk_id],
+            'chunk': db.get_chunk(*entry['chunk_id']),
+            'score': 1 / (index + 1),
             'from_semantic': is_from_semantic,
-            'from_bm25': is_from_bm25
+            'from_bm25': is_from_bm25,
+            'sources': entry['sources']
         })
         
         if is_from_semantic and not is_from_bm25:
@@ -142,77 +216,53 @@ def load_jsonl(file_path: str) -> List[Dict[str, Any]]:
     with open(file_path, 'r') as file:
         return [json.loads(line) for line in file]
 
-def evaluate_db_advanced(db: ContextualVectorDB, original_jsonl_path: str, k: int):
-    original_data = load_jsonl(original_jsonl_path)
-    es_bm25 = create_elasticsearch_bm25_index(db)
+def _source_shares(retrieved_docs: List[Dict[str, Any]]):
+    # Results found by both sources count half towards each.
+    semantic = sum(1 if not doc['from_bm25'] else 0.5 for doc in retrieved_docs if doc['from_semantic'])
+    bm25 = sum(1 if not doc['from_semantic'] else 0.5 for doc in retrieved_docs if doc['from_bm25'])
+    return semantic, bm25
+
+def evaluate_db_advanced(db: ContextualVectorDB, original_jsonl_path: str, k: Union[int, List[int]] = DEFAULT_KS, bm25_backend: str = "elasticsearch", **fusion_params):
+    evaluation_set = EvaluationSet.from_jsonl(original_jsonl_path)
+    es_bm25 = create_bm25_index(db, backend=bm25_backend)
+    fusion = hybrid_retriever(db, es_bm25, **fusion_params)
+    ks = [k] if isinstance(k, int) else list(k)
+    max_k = max(ks)
     
     try:
         # Warm-up queries
-        warm_up_queries = original_data[:10]
-        for query_item in warm_up_queries:
-            _ = retrieve_advanced(query_item['query'], db, es_bm25, k)
-        
-        total_score = 0
-        total_semantic_count = 0
-        total_bm25_count = 0
-        total_results = 0
-        
-        for query_item in tqdm(original_data, desc="Evaluating retrieval"):
-            query = query_item['query']
-            golden_chunk_uuids = query_item['golden_chunk_uuids']
-            
-            golden_contents = []
-            for doc_uuid, chunk_index in golden_chunk_uuids:
-                golden_doc = next((doc for doc in query_item['golden_documents'] if doc['uuid'] == doc_uuid), None)
-                if golden_doc:
-                    golden_chunk = next((chunk for chunk in golden_doc['chunks'] if chunk['index'] == chunk_index), None)
-                    if golden_chunk:
-                        golden_contents.append(golden_chunk['content'].strip())
-            
-            if not golden_contents:
-                print(f"Warning: No golden contents found for query: {query}")
-                continue
-            
-            retrieved_docs, semantic_count, bm25_count = retrieve_advanced(query, db, es_bm25, k)
-            
-            chunks_found = 0
-            for golden_content in golden_contents:
-                for doc in retrieved_docs[:k]:
-                    retrieved_content = doc['chunk']['original_content'].strip()
-                    if retrieved_content == golden_content:
-                        chunks_found += 1
-                        break
-            
-            query_score = chunks_found / len(golden_contents)
-            total_score += query_score
-            
-            total_semantic_count += semantic_count
-            total_bm25_count += bm25_count
-            total_results += len(retrieved_docs)
-        
-        total_queries = len(original_data)
-        average_score = total_score / total_queries
-        pass_at_n = average_score * 100
-        
-        semantic_percentage = (total_semantic_count / total_results) * 100 if total_results > 0 else 0
-        bm25_percentage = (total_bm25_count / total_results) * 100 if total_results > 0 else 0
-        
-        results = {
-            "pass_at_n": pass_at_n,
-            "average_score": average_score,
-            "total_queries": total_queries
-        }
+        for query in evaluation_set.queries[:10]:
+            _ = retrieve_advanced(query, db, es_bm25, max_k, fusion=fusion)
+
+        # One fused retrieval per query at the largest k; fused rankings are
+        # prefix-stable, so every smaller k is scored from the same lists
+        queries = evaluation_set.queries
+        semantic_batches = db.search_batch(queries, k=fusion.retrievers['semantic'].depth)
+        bm25_batches = es_bm25.search_many(queries, k=fusion.retrievers['bm25'].depth)
+        rankings = [
+            retrieve_advanced(query, db, es_bm25, max_k, semantic_results=semantic_results, bm25_results=bm25_results, fusion=fusion)[0]
+            for query, semantic_results, bm25_results in tqdm(zip(queries, semantic_batches, bm25_batches), total=len(queries), desc="Evaluating retrieval")
+        ]
+        results = evaluation_set.score(rankings, ks)
         
-        print(f"Pass@{k}: {pass_at_n:.2f}%")
-        print(f"Average Score: {average_score:.2f}")
-        print(f"Total queries: {total_queries}")
-        print(f"Percentage of results from semantic search: {semantic_percentage:.2f}%")
-        print(f"Percentage of results from BM25: {bm25_percentage:.2f}%")
+        percentages = {}
+        scored = [ranking for ranking, hashes in zip(rankings, evaluation_set.golden_hashes) if hashes]
+        for current_k in ks:
+            shares = [_source_shares(ranking[:current_k]) for ranking in scored]
+            total_results = sum(len(ranking[:current_k]) for ranking in scored)
+            semantic_percentage = sum(share[0] for share in shares) / total_results * 100 if total_results > 0 else 0
+            bm25_percentage = sum(share[1] for share in shares) / total_results * 100 if total_results > 0 else 0
+            percentages[current_k] = {"semantic": semantic_percentage, "bm25": bm25_percentage}
+
+        print_results(results)
+        for current_k in ks:
+            print(f"Percentage of results from semantic search @{current_k}: {percentages[current_k]['semantic']:.2f}%")
+            print(f"Percentage of results from BM25 @{current_k}: {percentages[current_k]['bm25']:.2f}%")
         
-        return results, {"semantic": semantic_percentage, "bm25": bm25_percentage}
+        return single_or_all(results, k), single_or_all(percentages, k)
     
     finally:
         # Delete the Elasticsearch index
-        if es_bm25.es_client.indices.exists(index=es_bm25.index_name):
+        if isinstance(es_bm25, ElasticsearchBM25) and es_bm25.es_client.indices.exists(index=es_bm25.index_name):
             es_bm25.es_client.delete(index=es_bm25.index_name)
             print(f"Deleted Elasticsearch index: {es_bm25.index_name}")
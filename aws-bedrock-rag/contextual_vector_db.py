@@ -1,46 +1,26 @@
 import os
-import pickle
-import json
 import numpy as np
-import voyageai
-from typing import List, Dict, Any
-from tqdm import tqdm
+from typing import Dict, Any, Optional
 import anthropic
+import asyncio
 import threading
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from ingest_journal import IngestJournal
+from rate_limiter import AdaptiveRateLimiter
+from context_cache import ContextCache, context_key, NO_USAGE
+from vector_db import VectorDB
 
-class ContextualVectorDB:
-    def __init__(self, name: str, voyage_api_key=None, anthropic_api_key=None):
-        if voyage_api_key is None:
-            voyage_api_key = os.getenv("VOYAGE_API_KEY")
-        if anthropic_api_key is None:
-            anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
-        
-        self.voyage_client = voyageai.Client(api_key=voyage_api_key)
-        self.anthropic_client = anthropic.Anthropic(api_key=anthropic_api_key)
-        self.name = name
-        self.embeddings = []
-        self.metadata = []
-        self.query_cache = {}
-        self.db_path = f"./data/{name}/contextual_vector_db.pkl"
-
-        self.token_counts = {
-            'input': 0,
-            'output': 0,
-            'cache_read': 0,
-            'cache_creation': 0
-        }
-        self.token_lock = threading.Lock()
+CONTEXT_MODEL = "claude-3-haiku-20240307"
+# Typical length of a generated context, for rate-limit reservations made before the call.
+CONTEXT_OUTPUT_ESTIMATE = 100
 
-    def situate_context(self, doc: str, chunk: str) -> tuple[str, Any]:
-        DOCUMENT_CONTEXT_PROMPT = """
+# Indented as originally written; the text is part of every context cache key.
+DOCUMENT_CONTEXT_PROMPT = """
         <document>
         {doc_content}
         </document>
         """
 
-        CHUNK_CONTEXT_PROMPT = """
+CHUNK_CONTEXT_PROMPT = """
         Here is the chunk we want to situate within the whole document
         <chunk>
         {chunk_content}
@@ -50,8 +30,76 @@ class ContextualVectorDB:
         Answer only with the succinct context and nothing else.
         """
 
-        response = self.anthropic_client.beta.prompt_caching.messages.create(
-            model="claude-3-haiku-20240307",
+def _is_throttle(error: Exception) -> bool:
+    # 429 rate limiting, or 529 when the API is overloaded.
+    return isinstance(error, anthropic.RateLimitError) or getattr(error, "status_code", None) == 529
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _billed_tokens(response) -> int:
+    # Cache reads are left out: they are what prompt caching makes cheap to repeat.
+    usage = response.usage
+    return (usage.input_tokens or 0) + (getattr(usage, "cache_creation_input_tokens", 0) or 0) + (usage.output_tokens or 0)
+
+
+class ContextualVectorDB(VectorDB):
+    """
+    VectorDB whose chunks are embedded together with a short context, generated
+    by Claude from the whole document, that situates the chunk within it.
+    """
+
+    storage_name = "contextual_vector_db"
+    display_name = "Contextual Vector database"
+
+    def __init__(self, name: str, voyage_api_key=None, anthropic_api_key=None,
+                 index_type: str = "flat", index_params: Optional[Dict[str, Any]] = None,
+                 embedding_model: str = "voyage-2", query_cache_size: int = 100_000,
+                 query_cache_bytes: int = 256 * 1024 * 1024, query_cache_path: Optional[str] = None,
+                 rate_limiter: Optional[AdaptiveRateLimiter] = None,
+                 context_cache_path: Optional[str] = "./data/context_cache.sqlite",
+                 voyage_client=None, anthropic_client=None, quantization: Optional[str] = None,
+                 quantization_params: Optional[Dict[str, Any]] = None, rescore_factor: int = 10,
+                 async_voyage_client=None, async_anthropic_client=None, max_async_requests: int = 256):
+        super().__init__(
+            name, voyage_api_key, index_type=index_type, index_params=index_params, embedding_model=embedding_model,
+            query_cache_size=query_cache_size, query_cache_bytes=query_cache_bytes, query_cache_path=query_cache_path,
+            voyage_client=voyage_client, quantization=quantization, quantization_params=quantization_params,
+            rescore_factor=rescore_factor, async_voyage_client=async_voyage_client, max_async_requests=max_async_requests,
+        )
+        if anthropic_api_key is None:
+            anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
+        self.anthropic_client = anthropic_client or anthropic.Anthropic(api_key=anthropic_api_key)
+        self._async_anthropic_client = async_anthropic_client
+        self._anthropic_api_key = anthropic_api_key
+
+        self.token_counts = {
+            'input': 0,
+            'output': 0,
+            'cache_read': 0,
+            'cache_creation': 0
+        }
+        self.document_cache_stats = {}
+        self.token_lock = threading.Lock()
+        # Shared by every ingest worker; pass one in to match your account's limits.
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        # Shared across databases by default: contexts depend only on model, prompt, document and chunk.
+        self.context_cache = ContextCache(context_cache_path) if context_cache_path else None
+
+    def _context_request(self, doc: str, chunk: str):
+        """Cache key, messages.create arguments and estimated token cost of one contextualisation call."""
+        cache_key = None
+        if self.context_cache is not None:
+            cache_key = context_key(CONTEXT_MODEL, DOCUMENT_CONTEXT_PROMPT + CHUNK_CONTEXT_PROMPT, doc, chunk)
+        request = dict(
+            model=CONTEXT_MODEL,
             max_tokens=1000,
             temperature=0.0,
             messages=[
@@ -72,57 +120,76 @@ class ContextualVectorDB:
             ],
             extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"}
         )
+        # Rough estimate (~4 characters per token) for the TPM bucket, if one is set. Only
+        # the chunk and a short answer are counted: after a document's first call its
+        # text is a cache read, and the reservation is settled with the real usage.
+        estimated_tokens = (len(CHUNK_CONTEXT_PROMPT) + len(chunk)) // 4 + CONTEXT_OUTPUT_ESTIMATE
+        return cache_key, request, estimated_tokens
+
+    def situate_context(self, doc: str, chunk: str) -> tuple[str, Any]:
+        cache_key, request, estimated_tokens = self._context_request(doc, chunk)
+        if cache_key is not None:
+            cached = self.context_cache.get(cache_key)
+            if cached is not None:
+                # Nothing was spent on this call; the stored usage is only kept for stats.
+                return cached[0], NO_USAGE
+
+        response = self.rate_limiter.call(
+            lambda: self.anthropic_client.beta.prompt_caching.messages.create(**request),
+            tokens=estimated_tokens, is_throttle=_is_throttle, retry_after=_retry_after, used_tokens=_billed_tokens
+        )
+        if cache_key is not None:
+            self.context_cache.put(cache_key, response.content[0].text, response.usage)
+        return response.content[0].text, response.usage
+
+    @property
+    def async_anthropic_client(self):
+        if self._async_anthropic_client is None:
+            self._async_anthropic_client = anthropic.AsyncAnthropic(api_key=self._anthropic_api_key)
+        return self._async_anthropic_client
+
+    async def asituate_context(self, doc: str, chunk: str) -> tuple[str, Any]:
+        """Async situate_context, sharing the context cache and rate limiter with the threaded path."""
+        cache_key, request, estimated_tokens = self._context_request(doc, chunk)
+        if cache_key is not None:
+            cached = await asyncio.to_thread(self.context_cache.get, cache_key)
+            if cached is not None:
+                return cached[0], NO_USAGE
+
+        async with self._async_semaphore():
+            response = await self.rate_limiter.acall(
+                lambda: self.async_anthropic_client.beta.prompt_caching.messages.create(**request),
+                tokens=estimated_tokens, is_throttle=_is_throttle, retry_after=_retry_after, used_tokens=_billed_tokens
+            )
+        if cache_key is not None:
+            await asyncio.to_thread(self.context_cache.put, cache_key, response.content[0].text, response.usage)
         return response.content[0].text, response.usage
 
-    def load_data(self, dataset: List[Dict[str, Any]], parallel_threads: int = 1):
-        if self.embeddings and self.metadata:
-            print("Vector database is already loaded. Skipping data loading.")
-            return
-        if os.path.exists(self.db_path):
-            print("Loading vector database from disk.")
-            self.load_db()
-            return
-
-        texts_to_embed = []
-        metadata = []
-        total_chunks = sum(len(doc['chunks']) for doc in dataset)
-
-        def process_chunk(doc, chunk):
-            contextualized_text, usage = self.situate_context(doc['content'], chunk['content'])
-            with self.token_lock:
-                self.token_counts['input'] += usage.input_tokens
-                self.token_counts['output'] += usage.output_tokens
-                self.token_counts['cache_read'] += usage.cache_read_input_tokens
-                self.token_counts['cache_creation'] += usage.cache_creation_input_tokens
-            
-            return {
-                'text_to_embed': f"{chunk['content']}\n\n{contextualized_text}",
-                'metadata': {
-                    'doc_id': doc['doc_id'],
-                    'original_uuid': doc['original_uuid'],
-                    'chunk_id': chunk['chunk_id'],
-                    'original_index': chunk['original_index'],
-                    'original_content': chunk['content'],
-                    'contextualized_content': contextualized_text
-                }
-            }
-
-        print(f"Processing {total_chunks} chunks with {parallel_threads} threads")
-        with ThreadPoolExecutor(max_workers=parallel_threads) as executor:
-            futures = []
-            for doc in dataset:
-                for chunk in doc['chunks']:
-                    futures.append(executor.submit(process_chunk, doc, chunk))
-            
-            for future in tqdm(as_completed(futures), total=total_chunks, desc="Processing chunks"):
-                result = future.result()
-                texts_to_embed.append(result['text_to_embed'])
-                metadata.append(result['metadata'])
-
-        self._embed_and_store(texts_to_embed, metadata)
-        self.save_db()
-
-        print(f"Contextual Vector database loaded and saved. Total chunks processed: {len(texts_to_embed)}")
+    def _ingest_threads(self, parallel_threads: Optional[int]) -> int:
+        # The rate limiter decides how many calls are actually in flight; the pool
+        # only needs enough threads to reach its ceiling.
+        return parallel_threads or self.rate_limiter.max_concurrency
+
+    def _prepare_chunk(self, doc: Dict[str, Any], chunk: Dict[str, Any], journal: IngestJournal) -> Dict[str, Any]:
+        contextualized_text, usage = self.situate_context(doc['content'], chunk['content'])
+        self._record_usage(doc['doc_id'], usage)
+        result = self._chunk_result(doc, chunk, contextualized_text)
+        # Journal from the worker so a failure elsewhere never loses a paid-for call.
+        journal.append_context(result['text_to_embed'], result['metadata'])
+        return result
+
+    async def _aprepare_chunk(self, doc: Dict[str, Any], chunk: Dict[str, Any], journal: IngestJournal) -> Dict[str, Any]:
+        contextualized_text, usage = await self.asituate_context(doc['content'], chunk['content'])
+        self._record_usage(doc['doc_id'], usage)
+        result = self._chunk_result(doc, chunk, contextualized_text)
+        await asyncio.to_thread(journal.append_context, result['text_to_embed'], result['metadata'])
+        return result
+
+    def _print_ingest_summary(self):
+        super()._print_ingest_summary()
+        self._print_token_summary()
+
+    def _print_token_summary(self):
         print(f"Total input tokens without caching: {self.token_counts['input']}")
         print(f"Total output tokens: {self.token_counts['output']}")
         print(f"Total input tokens written to cache: {self.token_counts['cache_creation']}")
@@ -132,56 +199,36 @@ class ContextualVectorDB:
         savings_percentage = (self.token_counts['cache_read'] / total_tokens) * 100 if total_tokens > 0 else 0
         print(f"Total input token savings from prompt caching: {savings_percentage:.2f}% of all input tokens used were read from cache.")
         print("Tokens read from cache come at a 90 percent discount!")
-
-    def _embed_and_store(self, texts: List[str], data: List[Dict[str, Any]]):
-        batch_size = 128
-        result = [
-            self.voyage_client.embed(
-                texts[i : i + batch_size],
-                model="voyage-2"
-            ).embeddings
-            for i in range(0, len(texts), batch_size)
-        ]
-        self.embeddings = [embedding for batch in result for embedding in batch]
-        self.metadata = data
-
-    def search(self, query: str, k: int = 20) -> List[Dict[str, Any]]:
-        if query in self.query_cache:
-            query_embedding = self.query_cache[query]
-        else:
-            query_embedding = self.voyage_client.embed([query], model="voyage-2").embeddings[0]
-            self.query_cache[query] = query_embedding
-
-        if not self.embeddings:
-            raise ValueError("No data loaded in the vector database.")
-
-        similarities = np.dot(self.embeddings, query_embedding)
-        top_indices = np.argsort(similarities)[::-1][:k]
-        
-        top_results = []
-        for idx in top_indices:
-            result = {
-                "metadata": self.metadata[idx],
-                "similarity": float(similarities[idx]),
-            }
-            top_results.append(result)
-        return top_results
-
-    def save_db(self):
-        data = {
-            "embeddings": self.embeddings,
-            "metadata": self.metadata,
-            "query_cache": json.dumps(self.query_cache),
-        }
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        with open(self.db_path, "wb") as file:
-            pickle.dump(data, file)
-
-    def load_db(self):
-        if not os.path.exists(self.db_path):
-            raise ValueError("Vector database file not found. Use load_data to create a new database.")
-        with open(self.db_path, "rb") as file:
-            data = pickle.load(file)
-        self.embeddings = data["embeddings"]
-        self.metadata = data["metadata"]
-        self.query_cache = json.loads(data["query_cache"])
+        print(f"Rate limiter: {self.rate_limiter.limits()}")
+        if self.context_cache is not None:
+            print(f"Context cache: {self.context_cache.stats()}")
+
+        ratios = self.document_cache_read_ratios()
+        if ratios:
+            coldest = sorted(ratios.items(), key=lambda item: item[1])[:5]
+            print(f"Mean per-document cache-read ratio: {np.mean(list(ratios.values())):.2%} over {len(ratios)} documents")
+            print("Lowest cache-read ratios: " + ", ".join(f"{doc_id}={ratio:.2%}" for doc_id, ratio in coldest))
+
+    def document_cache_read_ratios(self) -> Dict[str, float]:
+        """Fraction of each document's input tokens that were served from the prompt cache."""
+        with self.token_lock:
+            ratios = {}
+            for doc_id, stats in self.document_cache_stats.items():
+                total = stats['input'] + stats['cache_read'] + stats['cache_creation']
+                # Documents served entirely from the context cache made no API calls.
+                if total:
+                    ratios[doc_id] = stats['cache_read'] / total
+            return ratios
+
+    def _record_usage(self, doc_id: str, usage):
+        with self.token_lock:
+            self.token_counts['input'] += usage.input_tokens
+            self.token_counts['output'] += usage.output_tokens
+            self.token_counts['cache_read'] += usage.cache_read_input_tokens
+            self.token_counts['cache_creation'] += usage.cache_creation_input_tokens
+            doc_stats = self.document_cache_stats.setdefault(
+                doc_id, {'input': 0, 'cache_read': 0, 'cache_creation': 0}
+            )
+            doc_stats['input'] += usage.input_tokens
+            doc_stats['cache_read'] += usage.cache_read_input_tokens
+            doc_stats['cache_creation'] += usage.cache_creation_input_tokens
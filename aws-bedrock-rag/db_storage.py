@@ -0,0 +1,151 @@
+import os
+import json
+import mmap
+import shutil
+import numpy as np
+from collections.abc import Sequence
+from typing import List, Dict, Any, Optional
+
+FORMAT_VERSION = 2
+
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.jsonl"
+METADATA_OFFSETS_FILE = "metadata_offsets.npy"
+CHUNK_KEYS_FILE = "chunk_keys.json"
+QUERY_CACHE_FILE = "query_cache.json"
+INDEX_FILE = "index.npz"
+QUANTIZATION_FILE = "quantization.npz"
+METADATA_INDEX_FILE = "metadata_index.npz"
+
+
+class JsonlMetadata(Sequence):
+    """
+    Read-only list of metadata dicts backed by a JSONL file. Rows are decoded on
+    access using a byte-offset table, so opening a large database costs nothing.
+    """
+
+    def __init__(self, path: str, offsets_path: str):
+        self.path = path
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self._file = open(path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("metadata index out of range")
+        return json.loads(self._data[self.offsets[idx]:self.offsets[idx + 1]])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __getstate__(self):
+        return {"path": self.path, "offsets_path": self.offsets.filename}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["offsets_path"])
+
+
+def _write_metadata(directory: str, metadata):
+    offsets = [0]
+    chunk_keys = []
+    with open(os.path.join(directory, METADATA_FILE), "wb") as file:
+        for item in metadata:
+            line = json.dumps(item).encode("utf-8") + b"\n"
+            file.write(line)
+            offsets.append(offsets[-1] + len(line))
+            chunk_keys.append([item.get("doc_id"), item.get("original_index")])
+    np.save(os.path.join(directory, METADATA_OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    # (doc_id, original_index) per row, so the row lookup loads without decoding metadata.
+    with open(os.path.join(directory, CHUNK_KEYS_FILE), "w") as file:
+        json.dump(chunk_keys, file)
+
+
+def save_directory(directory: str, embeddings: np.ndarray, metadata, query_cache: Dict[str, List[float]],
+                   index_state: Optional[Dict[str, Any]] = None, extra: Optional[Dict[str, Any]] = None,
+                   quantization_state: Optional[Dict[str, Any]] = None,
+                   metadata_index_state: Optional[Dict[str, Any]] = None):
+    """
+    Write a database directory. Files are written to a sibling temp directory and
+    swapped in at the end, so readers that still have the old embeddings mapped
+    are unaffected and a crash never leaves a half-written database behind.
+    """
+    tmp_dir = directory.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), np.ascontiguousarray(embeddings, dtype=np.float32))
+    _write_metadata(tmp_dir, metadata)
+    with open(os.path.join(tmp_dir, QUERY_CACHE_FILE), "w") as file:
+        json.dump(query_cache, file)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "count": int(embeddings.shape[0]),
+        "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+        "index": None,
+        "quantization": None,
+        "metadata_index": None,
+    }
+    for key, state, filename in (("index", index_state, INDEX_FILE), ("quantization", quantization_state, QUANTIZATION_FILE),
+                                 ("metadata_index", metadata_index_state, METADATA_INDEX_FILE)):
+        if state is not None:
+            arrays = {name: value for name, value in state.items() if isinstance(value, np.ndarray)}
+            manifest[key] = {name: value for name, value in state.items() if name not in arrays}
+            np.savez(os.path.join(tmp_dir, filename), **arrays)
+    manifest.update(extra or {})
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=2)
+
+    old_dir = directory.rstrip(os.sep) + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, old_dir)
+    os.rename(tmp_dir, directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def load_directory(directory: str) -> Dict[str, Any]:
+    with open(os.path.join(directory, MANIFEST_FILE)) as file:
+        manifest = json.load(file)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported vector database format version {manifest.get('format_version')} "
+            f"(expected {FORMAT_VERSION})."
+        )
+
+    states = {}
+    for key, filename in (("index", INDEX_FILE), ("quantization", QUANTIZATION_FILE), ("metadata_index", METADATA_INDEX_FILE)):
+        states[key] = None
+        if manifest[key] is not None:
+            states[key] = dict(manifest[key])
+            with np.load(os.path.join(directory, filename)) as arrays:
+                states[key].update({name: arrays[name] for name in arrays.files})
+
+    with open(os.path.join(directory, QUERY_CACHE_FILE)) as file:
+        query_cache = json.load(file)
+
+    with open(os.path.join(directory, CHUNK_KEYS_FILE)) as file:
+        chunk_keys = [tuple(key) for key in json.load(file)]
+
+    return {
+        "manifest": manifest,
+        "embeddings": np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r"),
+        "metadata": JsonlMetadata(
+            os.path.join(directory, METADATA_FILE), os.path.join(directory, METADATA_OFFSETS_FILE)
+        ),
+        "query_cache": query_cache,
+        "chunk_keys": chunk_keys,
+        "index": states["index"],
+        "quantization": states["quantization"],
+        "metadata_index": states["metadata_index"],
+    }
@@ -0,0 +1,73 @@
+import numpy as np
+from typing import Optional
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingMatrix:
+    """
+    Contiguous, L2-normalised float32 embedding matrix. Rows are appended into a
+    preallocated buffer that grows geometrically, so ingest is amortised O(1) per
+    row and searches always see a single C-contiguous array.
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024, growth_factor: float = 1.5):
+        self.dim = dim
+        self.initial_capacity = initial_capacity
+        self.growth_factor = growth_factor
+        self._buffer = None
+        self._size = 0
+
+    @classmethod
+    def from_array(cls, vectors) -> "EmbeddingMatrix":
+        matrix = cls()
+        if len(vectors):
+            matrix.append(vectors)
+        return matrix
+
+    @classmethod
+    def wrap(cls, vectors: np.ndarray) -> "EmbeddingMatrix":
+        """
+        Adopt an already-normalised float32 array (e.g. a read-only memmap) without
+        copying. The first append moves the rows into a private, writable buffer.
+        """
+        matrix = cls(dim=vectors.shape[1])
+        matrix._buffer = vectors
+        matrix._size = vectors.shape[0]
+        return matrix
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._buffer is None:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return self._buffer[:self._size]
+
+    def _reserve(self, capacity: int):
+        if self._buffer is not None and capacity <= self._buffer.shape[0]:
+            return
+        new_capacity = max(capacity, self.initial_capacity)
+        if self._buffer is not None:
+            new_capacity = max(new_capacity, int(self._buffer.shape[0] * self.growth_factor))
+        buffer = np.empty((new_capacity, self.dim), dtype=np.float32)
+        if self._buffer is not None:
+            buffer[:self._size] = self._buffer[:self._size]
+        self._buffer = buffer
+
+    def append(self, vectors) -> range:
+        vectors = l2_normalize(np.atleast_2d(vectors))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got {vectors.shape[1]}.")
+        start = self._size
+        self._reserve(start + vectors.shape[0])
+        self._buffer[start:start + vectors.shape[0]] = vectors
+        self._size += vectors.shape[0]
+        return range(start, self._size)
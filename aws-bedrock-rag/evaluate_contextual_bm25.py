@@ -1,3 +1,2 @@
-results5 = evaluate_db_advanced(contextual_db, 'data/evaluation_set.jsonl', 5)
-results10 = evaluate_db_advanced(contextual_db, 'data/evaluation_set.jsonl', 10)
-results20 = evaluate_db_advanced(contextual_db, 'data/evaluation_set.jsonl', 20)
+results, source_percentages = evaluate_db_advanced(contextual_db, 'data/evaluation_set.jsonl', [5, 10, 20])
+results5, results10, results20 = results[5], results[10], results[20]
@@ -1,3 +1,2 @@
-r5 = evaluate_db(contextual_db, 'data/evaluation_set.jsonl', 5)
-r10 = evaluate_db(contextual_db, 'data/evaluation_set.jsonl', 10)
-r20 = evaluate_db(contextual_db, 'data/evaluation_set.jsonl', 20)
+r = evaluate_db(contextual_db, 'data/evaluation_set.jsonl', [5, 10, 20])
+r5, r10, r20 = r[5], r[10], r[20]
@@ -0,0 +1,153 @@
+import json
+import hashlib
+import numpy as np
+from typing import List, Dict, Any, Callable, Sequence, Union
+
+DEFAULT_KS = (5, 10, 20)
+
+
+def content_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.strip().encode("utf-8"), digest_size=16).digest()
+
+
+def retrieved_content(item: Dict[str, Any]) -> str:
+    """Original chunk text of a retrieval result, from either a `metadata` (search) or `chunk` (hybrid/rerank) result."""
+    chunk = item['chunk'] if 'chunk' in item else item['metadata']
+    return chunk.get('original_content', chunk.get('content', ''))
+
+
+def _chunk_key(item: Dict[str, Any]):
+    chunk = item['chunk'] if 'chunk' in item else item['metadata']
+    if 'doc_id' in chunk and 'original_index' in chunk:
+        return chunk['doc_id'], chunk['original_index']
+    return None
+
+
+class EvaluationSet:
+    """
+    Evaluation queries with their golden chunks resolved once: golden chunk ids
+    and content hashes are computed up front, so scoring a ranking is a hash
+    lookup per retrieved chunk instead of a string comparison per golden chunk.
+    A retrieved chunk counts as a hit when its stripped original content equals
+    a golden chunk's, as in the original harnesses.
+    """
+
+    def __init__(self, queries: List[Dict[str, Any]]):
+        self.items = queries
+        self.queries = [query_item['query'] for query_item in queries]
+        self.golden_ids = []
+        self.golden_hashes = []
+        for query_item in queries:
+            documents = {doc['uuid']: doc for doc in query_item['golden_documents']}
+            ids, hashes = [], []
+            for doc_uuid, chunk_index in query_item['golden_chunk_uuids']:
+                golden_doc = documents.get(doc_uuid)
+                if not golden_doc:
+                    print(f"Warning: Golden document not found for UUID {doc_uuid}")
+                    continue
+                golden_chunk = next((chunk for chunk in golden_doc['chunks'] if chunk['index'] == chunk_index), None)
+                if not golden_chunk:
+                    print(f"Warning: Golden chunk not found for index {chunk_index} in document {doc_uuid}")
+                    continue
+                ids.append((doc_uuid, chunk_index))
+                hashes.append(content_hash(golden_chunk['content']))
+            if not hashes:
+                print(f"Warning: No golden contents found for query: {query_item['query']}")
+            self.golden_ids.append(ids)
+            self.golden_hashes.append(hashes)
+        self._hash_memo = {}
+
+    @classmethod
+    def from_jsonl(cls, path: str) -> "EvaluationSet":
+        with open(path, 'r') as file:
+            return cls([json.loads(line) for line in file])
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def _hash_of(self, item: Dict[str, Any], content: Callable[[Dict[str, Any]], str]) -> bytes:
+        key = _chunk_key(item) if content is retrieved_content else None
+        if key is None:
+            return content_hash(content(item))
+        digest = self._hash_memo.get(key)
+        if digest is None:
+            digest = self._hash_memo[key] = content_hash(content(item))
+        return digest
+
+    def first_hit_ranks(self, rankings: List[List[Dict[str, Any]]], depth: int,
+                        content: Callable[[Dict[str, Any]], str] = retrieved_content) -> np.ndarray:
+        """
+        (queries x max golden) matrix holding the 0-based rank at which each golden
+        chunk is first retrieved within `depth`; misses and padding are `depth`.
+        """
+        width = max((len(hashes) for hashes in self.golden_hashes), default=0)
+        ranks = np.full((len(self.items), max(width, 1)), depth, dtype=np.int64)
+        for row, (hashes, ranking) in enumerate(zip(self.golden_hashes, rankings)):
+            if not hashes:
+                continue
+            positions = {}
+            for golden, digest in enumerate(hashes):
+                positions.setdefault(digest, []).append(golden)
+            for rank, item in enumerate(ranking[:depth]):
+                for golden in positions.pop(self._hash_of(item, content), ()):
+                    ranks[row, golden] = rank
+                if not positions:
+                    break
+        return ranks
+
+    def score(self, rankings: List[List[Dict[str, Any]]], ks: Union[int, Sequence[int]] = DEFAULT_KS,
+              content: Callable[[Dict[str, Any]], str] = retrieved_content) -> Dict[int, Dict[str, float]]:
+        """
+        Metrics for every k from one ranking per query retrieved at max(k):
+
+        - pass_at_n / average_score: mean fraction of golden chunks in the top k (the harnesses' Pass@k)
+        - recall: same fraction, as a ratio
+        - hit_rate: share of queries with at least one golden chunk in the top k
+        - mrr: mean reciprocal rank of the first golden chunk within k
+        - ndcg: binary-relevance nDCG@k
+
+        Queries without golden chunks score 0 but still count towards the totals.
+        """
+        ks = [ks] if isinstance(ks, int) else list(ks)
+        depth = max(ks)
+        ranks = self.first_hit_ranks(rankings, depth, content)
+        n_golden = np.array([len(hashes) for hashes in self.golden_hashes], dtype=np.float64)
+        valid = n_golden > 0
+        golden_mask = np.arange(ranks.shape[1])[None, :] < n_golden[:, None]
+        total_queries = len(self.items)
+        discounts = 1.0 / np.log2(np.arange(depth) + 2.0)
+        gains = np.where(ranks < depth, discounts[np.minimum(ranks, depth - 1)], 0.0)
+        first = ranks.min(axis=1)
+
+        results = {}
+        for k in ks:
+            found = (ranks < k) & golden_mask
+            recall = np.where(valid, found.sum(axis=1) / np.maximum(n_golden, 1), 0.0)
+            mrr = np.where(valid & (first < k), 1.0 / (first + 1.0), 0.0)
+            dcg = np.where(found, gains, 0.0).sum(axis=1)
+            ideal = np.cumsum(discounts[:k])[np.minimum(n_golden, k).astype(np.int64) - 1]
+            ndcg = np.where(valid, dcg / np.where(valid, ideal, 1.0), 0.0)
+            average_score = float(recall.sum() / total_queries) if total_queries else 0.0
+            results[k] = {
+                "pass_at_n": average_score * 100,
+                "average_score": average_score,
+                "recall": average_score,
+                "hit_rate": float((found.any(axis=1) & valid).sum() / total_queries) if total_queries else 0.0,
+                "mrr": float(mrr.sum() / total_queries) if total_queries else 0.0,
+                "ndcg": float(ndcg.sum() / total_queries) if total_queries else 0.0,
+                "total_queries": total_queries,
+            }
+        return results
+
+
+def print_results(results: Dict[int, Dict[str, float]]):
+    for k, metrics in results.items():
+        print(f"Pass@{k}: {metrics['pass_at_n']:.2f}%")
+        print(f"Average Score: {metrics['average_score']:.4f}")
+        print(f"Hit rate@{k}: {metrics['hit_rate'] * 100:.2f}%  MRR@{k}: {metrics['mrr']:.4f}  nDCG@{k}: {metrics['ndcg']:.4f}")
+        print(f"Total queries: {metrics['total_queries']}")
+
+
+def single_or_all(results: Dict[int, Dict[str, float]], k: Union[int, Sequence[int]]):
+    """Callers that asked for one k get that k's metrics, as before; a list of ks gets the full mapping."""
+    return results[k] if isinstance(k, int) else results
@@ -0,0 +1,137 @@
+import json
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Sequence, Union
+from tqdm import tqdm
+from evaluation import DEFAULT_KS, EvaluationSet
+from contextual_bm25 import hybrid_retriever, retrieve_advanced
+
+STAGES = ("embed", "dense_search", "bm25", "fusion", "rerank")
+PERCENTILES = (50, 95, 99)
+
+
+class EvaluationRunner:
+    """
+    Benchmarking evaluation: queries run on a pool of `max_workers` threads, and
+    each query's time is split into embed, dense search, BM25, fusion and rerank
+    stages (the stages of one query run back to back, so they add up to its
+    latency). The report has Pass@k and the other metrics next to per-stage
+    p50/p95/p99 latency and throughput, and can be written as JSON to diff runs.
+
+    Pass `bm25` to evaluate hybrid retrieval and `reranker` to rerank the top
+    `rerank_depth` x k candidates of whichever retrieval runs before it.
+    """
+
+    def __init__(self, db, bm25=None, reranker=None, max_workers: int = 8, warmup: int = 10,
+                 rerank_depth: int = 10, fusion_params: Optional[Dict[str, Any]] = None):
+        self.db = db
+        self.bm25 = bm25
+        self.reranker = reranker
+        self.max_workers = max_workers
+        self.warmup = warmup
+        self.rerank_depth = rerank_depth
+        self.fusion_params = fusion_params or {}
+        self.fusion = hybrid_retriever(db, bm25, **self.fusion_params) if bm25 is not None else None
+
+    def run_query(self, query: str, k: int):
+        timings = {}
+        depth = k * self.rerank_depth if self.reranker is not None else k
+        dense_depth = self.fusion.retrievers['semantic'].depth if self.fusion is not None else depth
+
+        start = time.perf_counter()
+        query_embedding = self.db.embed_queries([query])
+        timings["embed"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ranking = self.db.search_embeddings(query_embedding, k=dense_depth)[0]
+        timings["dense_search"] = time.perf_counter() - start
+
+        if self.fusion is not None:
+            start = time.perf_counter()
+            bm25_results = self.bm25.search(query, k=self.fusion.retrievers['bm25'].depth)
+            timings["bm25"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            fused, _, _ = retrieve_advanced(query, self.db, self.bm25, depth, semantic_results=ranking,
+                                            bm25_results=bm25_results, fusion=self.fusion)
+            ranking = [{"metadata": result['chunk'], **result} for result in fused]
+            timings["fusion"] = time.perf_counter() - start
+
+        if self.reranker is not None:
+            start = time.perf_counter()
+            ranking = [
+                {"chunk": ranking[index]['metadata'], "score": score}
+                for index, score in self.reranker.rerank(query, ranking[:depth], top_n=k)
+            ]
+            timings["rerank"] = time.perf_counter() - start
+
+        timings["total"] = sum(timings.values())
+        return ranking[:k], timings
+
+    def run(self, evaluation_set: Union[str, EvaluationSet], ks: Sequence[int] = DEFAULT_KS,
+            output_path: Optional[str] = None) -> Dict[str, Any]:
+        if isinstance(evaluation_set, str):
+            evaluation_set = EvaluationSet.from_jsonl(evaluation_set)
+        ks = list(ks)
+        max_k = max(ks)
+        queries = evaluation_set.queries
+
+        # Warm-up queries (embedding cache, index pages, connection pools) are not recorded
+        for query in queries[:self.warmup]:
+            self.run_query(query, max_k)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            start = time.perf_counter()
+            outcomes = list(tqdm(executor.map(lambda query: self.run_query(query, max_k), queries),
+                                 total=len(queries), desc="Evaluating retrieval"))
+            wall_seconds = time.perf_counter() - start
+
+        rankings = [ranking for ranking, _ in outcomes]
+        timings = [query_timings for _, query_timings in outcomes]
+        report = {
+            "config": {
+                "pipeline": "+".join(
+                    ["dense"] + (["bm25", "fusion"] if self.fusion is not None else [])
+                    + (["rerank"] if self.reranker is not None else [])
+                ),
+                "ks": ks,
+                "max_workers": self.max_workers,
+                "warmup": self.warmup,
+                "rerank_depth": self.rerank_depth if self.reranker is not None else None,
+                "fusion": {key: value for key, value in self.fusion_params.items()},
+            },
+            "metrics": {str(k): metrics for k, metrics in evaluation_set.score(rankings, ks).items()},
+            "latency_ms": latency_summary(timings),
+            "throughput_qps": len(queries) / wall_seconds if wall_seconds > 0 else 0.0,
+            "wall_seconds": wall_seconds,
+            "total_queries": len(queries),
+        }
+
+        print_report(report)
+        if output_path is not None:
+            with open(output_path, "w") as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+            print(f"Wrote evaluation report to {output_path}")
+        return report
+
+
+def latency_summary(timings: List[Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """Mean and p50/p95/p99 in milliseconds for each stage that ran."""
+    summary = {}
+    for stage in STAGES + ("total",):
+        values = np.array([query_timings[stage] for query_timings in timings if stage in query_timings]) * 1000
+        if not values.shape[0]:
+            continue
+        summary[stage] = {"mean": float(values.mean())}
+        summary[stage].update({f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))})
+    return summary
+
+
+def print_report(report: Dict[str, Any]):
+    for k, metrics in report["metrics"].items():
+        print(f"Pass@{k}: {metrics['pass_at_n']:.2f}%  MRR@{k}: {metrics['mrr']:.4f}  nDCG@{k}: {metrics['ndcg']:.4f}")
+    print(f"Throughput: {report['throughput_qps']:.1f} queries/s over {report['total_queries']} queries "
+          f"({report['config']['max_workers']} workers)")
+    for stage, stats in report["latency_ms"].items():
+        print(f"  {stage:<13} p50 {stats['p50']:8.2f} ms  p95 {stats['p95']:8.2f} ms  p99 {stats['p99']:8.2f} ms")
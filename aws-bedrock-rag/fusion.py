@@ -0,0 +1,225 @@
+import time
+import itertools
+import threading
+import numpy as np
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import List, Dict, Any, Callable, Hashable, Optional, Sequence
+
+FUSION_METHODS = ("rrf", "minmax", "zscore")
+
+class Retriever:
+    """
+    One source of ranked candidates for fusion. `search(query, k)` returns hits
+    best first; `key` maps a hit to its chunk id and `score` to its raw score.
+    `depth` is how many candidates to request from this source and `timeout`
+    (seconds, None for no limit) how long a fused query waits for it.
+
+    Searches run on the source's own pool of `max_concurrency` threads, so a hung
+    source can only exhaust its own threads. While a search that missed its
+    deadline is still running, the source is skipped instead of queueing more.
+    """
+
+    def __init__(self, name: str, search: Callable[[str, int], List[Dict[str, Any]]],
+                 key: Callable[[Dict[str, Any]], Hashable], score: Callable[[Dict[str, Any]], float],
+                 depth: int = 150, weight: float = 1.0, timeout: Optional[float] = None, max_concurrency: int = 8):
+        self.name = name
+        self.search = search
+        self.key = key
+        self.score = score
+        self.depth = depth
+        self.weight = weight
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._executor = None
+        self._stalled = []
+        self._lock = threading.Lock()
+
+    def submit(self, query: str) -> Optional[Future]:
+        """Start a search on this source's pool, or return None while a timed-out search is still running."""
+        with self._lock:
+            self._stalled = [future for future in self._stalled if not future.done()]
+            if self._stalled:
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                    thread_name_prefix=f"retriever-{self.name}")
+            return self._executor.submit(self.search, query, self.depth)
+
+    def abandon(self, future: Future):
+        """Give up on a search that missed its deadline; if it is already running, hold off the source until it ends."""
+        if not future.cancel():
+            with self._lock:
+                self._stalled.append(future)
+
+
+def dense_retriever(db, depth: int = 150, weight: float = 1.0, name: str = "semantic", timeout: Optional[float] = None) -> Retriever:
+    return Retriever(
+        name,
+        lambda query, k: db.search(query, k=k),
+        key=lambda hit: (hit['metadata']['doc_id'], hit['metadata']['original_index']),
+        score=lambda hit: hit['similarity'],
+        depth=depth,
+        weight=weight,
+        timeout=timeout,
+    )
+
+
+def bm25_retriever(bm25, depth: int = 150, weight: float = 1.0, name: str = "bm25", timeout: Optional[float] = None) -> Retriever:
+    return Retriever(
+        name,
+        lambda query, k: bm25.search(query, k=k),
+        key=lambda hit: (hit['doc_id'], hit['original_index']),
+        score=lambda hit: hit['score'],
+        depth=depth,
+        weight=weight,
+        timeout=timeout,
+    )
+
+
+def _normalized_scores(scores: np.ndarray, method: str) -> np.ndarray:
+    if method == "minmax":
+        spread = scores.max() - scores.min()
+        return (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+    std = scores.std()
+    return (scores - scores.mean()) / std if std > 0 else np.zeros_like(scores)
+
+
+def fuse(results: Dict[str, List[Dict[str, Any]]], retrievers: Dict[str, Retriever], method: str = "rrf",
+         rrf_k: float = 60.0, weights: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+    """
+    Fuse per-source ranked hits into one ranking.
+
+    - "rrf": sum of weight / (rrf_k + rank), rank starting at 1
+    - "minmax" / "zscore": weighted sum of per-source normalised scores; a source
+      that did not return a chunk contributes its lowest normalised score
+
+    Each fused entry carries per-source attribution: rank, raw score and contribution.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method '{method}'. Expected one of: {', '.join(FUSION_METHODS)}")
+    weights = weights or {name: retriever.weight for name, retriever in retrievers.items()}
+
+    fused = {}
+    floors = {}
+    for name, retriever in retrievers.items():
+        hits = results.get(name)
+        if not hits:
+            continue
+        if method == "rrf":
+            contributions = [weights[name] / (rrf_k + rank) for rank in range(1, len(hits) + 1)]
+        else:
+            normalized = _normalized_scores(np.asarray([retriever.score(hit) for hit in hits], dtype=np.float64), method)
+            contributions = (weights[name] * normalized).tolist()
+            floors[name] = weights[name] * float(normalized.min())
+        for rank, (hit, contribution) in enumerate(zip(hits, contributions), start=1):
+            key = retriever.key(hit)
+            entry = fused.setdefault(key, {'chunk_id': key, 'score': 0.0, 'hit': hit, 'sources': {}})
+            if name in entry['sources']:
+                continue  # duplicates within one source keep their best rank
+            entry['sources'][name] = {'rank': rank, 'score': retriever.score(hit), 'contribution': contribution}
+            entry['score'] += contribution
+
+    for entry in fused.values():
+        for name, floor in floors.items():
+            if name not in entry['sources']:
+                entry['score'] += floor
+
+    return sorted(fused.values(), key=lambda entry: (entry['score'], entry['chunk_id']), reverse=True)
+
+
+class FusionRetriever:
+    """
+    Runs any number of retrievers concurrently, each at its own depth, and fuses
+    their rankings. A source that misses its deadline or fails is dropped from
+    that query's fusion (and counted in `stats()`) as long as another source
+    answered, so latency tracks the slowest source within its timeout rather
+    than the sum of all of them. A source still busy with a timed-out search is
+    skipped (counted as `skipped`) rather than queued behind it.
+    """
+
+    def __init__(self, retrievers: Sequence[Retriever], method: str = "rrf", rrf_k: float = 60.0):
+        self.retrievers = {retriever.name: retriever for retriever in retrievers}
+        self.method = method
+        self.rrf_k = rrf_k
+        self.timeouts = Counter()
+        self.errors = Counter()
+        self.skipped = Counter()
+        self._stats_lock = threading.Lock()
+
+    def gather(self, query: str, precomputed: Optional[Dict[str, List[Dict[str, Any]]]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        results = dict(precomputed or {})
+        missing = [retriever for name, retriever in self.retrievers.items() if name not in results]
+        if len(missing) == 1 and missing[0].timeout is None:
+            results[missing[0].name] = missing[0].search(query, missing[0].depth)
+            return results
+        if not missing:
+            return results
+
+        start = time.monotonic()
+        futures = {}
+        failures = {}
+        for retriever in missing:
+            future = retriever.submit(query)
+            if future is None:
+                failures[retriever.name] = FutureTimeout()
+                with self._stats_lock:
+                    self.skipped[retriever.name] += 1
+            else:
+                futures[retriever.name] = future
+        for name, future in futures.items():
+            timeout = self.retrievers[name].timeout
+            remaining = None if timeout is None else max(0.0, start + timeout - time.monotonic())
+            try:
+                results[name] = future.result(timeout=remaining)
+            except FutureTimeout as e:
+                self.retrievers[name].abandon(future)
+                failures[name] = e
+                with self._stats_lock:
+                    self.timeouts[name] += 1
+            except Exception as e:
+                failures[name] = e
+                with self._stats_lock:
+                    self.errors[name] += 1
+
+        if failures and not any(name in results for name in self.retrievers):
+            # Nothing to degrade to
+            name, error = next(iter(failures.items()))
+            if isinstance(error, FutureTimeout):
+                raise TimeoutError(f"All retrievers missed their deadline for query: {query!r}")
+            raise error
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {"timeouts": dict(self.timeouts), "errors": dict(self.errors), "skipped": dict(self.skipped)}
+
+    def retrieve(self, query: str, k: int, precomputed: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                 weights: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+        results = self.gather(query, precomputed)
+        return fuse(results, self.retrievers, self.method, self.rrf_k, weights)[:k]
+
+
+def learn_weights(training: List[Dict[str, List[Dict[str, Any]]]], relevant: List[set], retrievers: Dict[str, Retriever],
+                  method: str = "minmax", k: int = 20, rrf_k: float = 60.0, steps: int = 10) -> Dict[str, float]:
+    """
+    Fit linear fusion weights on labelled queries: grid search over the weight
+    simplex (in 1/steps increments) for the weights with the best mean Recall@k.
+    `training` holds each query's per-source hits; `relevant` its relevant chunk ids.
+    """
+    names = list(retrievers)
+    best_weights, best_recall = None, -1.0
+    for combo in itertools.product(range(steps + 1), repeat=len(names)):
+        if sum(combo) != steps:
+            continue
+        weights = {name: value / steps for name, value in zip(names, combo)}
+        recalls = []
+        for results, relevant_ids in zip(training, relevant):
+            if not relevant_ids:
+                continue
+            top = fuse(results, retrievers, method, rrf_k, weights)[:k]
+            recalls.append(len({entry['chunk_id'] for entry in top} & relevant_ids) / len(relevant_ids))
+        recall = float(np.mean(recalls)) if recalls else 0.0
+        if recall > best_recall:
+            best_weights, best_recall = weights, recall
+    return best_weights
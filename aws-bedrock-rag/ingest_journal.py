@@ -0,0 +1,108 @@
+import os
+import json
+import shutil
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+
+ChunkKey = Tuple[str, int]
+
+
+def chunk_key(doc_id: str, original_index: int) -> ChunkKey:
+    return (doc_id, int(original_index))
+
+
+class IngestJournal:
+    """
+    Append-only record of ingest progress. Each contextualised chunk is one line in
+    contexts.jsonl; each embedded batch is appended to embeddings.f32 and then
+    committed by a line in embedded.jsonl, tagged with the embedding model and
+    dimension. A restarted ingest replays both files and only redoes work that has
+    no committed record for its model.
+    """
+
+    CONTEXTS_FILE = "contexts.jsonl"
+    EMBEDDED_FILE = "embedded.jsonl"
+    VECTORS_FILE = "embeddings.f32"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def _append_line(path: str, record: Dict[str, Any]):
+        with open(path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    @staticmethod
+    def _read_lines(path: str) -> List[Dict[str, Any]]:
+        if not os.path.exists(path):
+            return []
+        records = []
+        with open(path) as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A crash mid-write leaves at most one torn line at the end.
+                    break
+        return records
+
+    def append_context(self, text_to_embed: str, metadata: Dict[str, Any]):
+        with self._lock:
+            self._append_line(self._path(self.CONTEXTS_FILE), {"text_to_embed": text_to_embed, "metadata": metadata})
+
+    def contexts(self) -> Dict[ChunkKey, Dict[str, Any]]:
+        return {
+            chunk_key(record["metadata"]["doc_id"], record["metadata"]["original_index"]): record
+            for record in self._read_lines(self._path(self.CONTEXTS_FILE))
+        }
+
+    def append_embeddings(self, keys: List[ChunkKey], embeddings, model: str):
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        with self._lock:
+            vectors_path = self._path(self.VECTORS_FILE)
+            offset = os.path.getsize(vectors_path) if os.path.exists(vectors_path) else 0
+            with open(vectors_path, "ab") as file:
+                file.write(vectors.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            # The batch only counts once this line is written.
+            self._append_line(self._path(self.EMBEDDED_FILE), {
+                "keys": [list(key) for key in keys],
+                "offset": offset,
+                "dim": int(vectors.shape[1]),
+                "model": model,
+            })
+
+    def embedded(self, model: str, dim: Optional[int] = None) -> Dict[ChunkKey, np.ndarray]:
+        """
+        Committed vectors from `model` (and of dimension `dim`, if given). Batches
+        from another model are skipped and get re-embedded, so a resumed run never
+        mixes embedding spaces.
+        """
+        vectors_path = self._path(self.VECTORS_FILE)
+        if not os.path.exists(vectors_path):
+            return {}
+        raw = np.fromfile(vectors_path, dtype=np.uint8)
+        result = {}
+        for record in self._read_lines(self._path(self.EMBEDDED_FILE)):
+            n_bytes = len(record["keys"]) * record["dim"] * 4
+            if record["offset"] + n_bytes > raw.shape[0]:
+                break
+            if record["model"] != model or (dim is not None and record["dim"] != dim):
+                continue
+            batch = raw[record["offset"]:record["offset"] + n_bytes].view(np.float32).reshape(-1, record["dim"])
+            for key, vector in zip(record["keys"], batch):
+                result[chunk_key(*key)] = vector
+        return result
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
@@ -6,5 +6,5 @@ with open('data/codebase_chunks.json', 'r') as f:
 contextual_db = ContextualVectorDB("my_contextual_db")
 
 # Load and process the data
-# note: consider increasing the number of parallel threads to run this faster, or reducing the number of parallel threads if concerned about hitting your API rate limit
-contextual_db.load_data(transformed_dataset, parallel_threads=5)
+# note: concurrency backs off whenever the API returns 429/529, so no limits need configuring; to also stay under a fixed budget, pass rate_limiter=AdaptiveRateLimiter(requests_per_minute=..., tokens_per_minute=...) to ContextualVectorDB
+contextual_db.load_data(transformed_dataset)
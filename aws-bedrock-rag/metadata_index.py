@@ -0,0 +1,132 @@
+import numpy as np
+from typing import List, Dict, Any, Sequence
+
+FILTER_FIELDS = ("doc_id", "original_uuid", "source", "file_path")
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+class MetadataIndex:
+    """
+    Posting lists over filterable metadata fields: for each field, value ->
+    sorted array of rows holding it. `select(filter)` resolves a filter
+    expression to the sorted eligible rows by merging posting lists, so it costs
+    O(matching rows) rather than a scan of the corpus.
+
+    Filter expressions are dicts. Multiple fields are ANDed:
+
+        {"doc_id": "doc_1"}                        equality
+        {"source": ["repo-a", "repo-b"]}           any of (also {"$in": [...]})
+        {"file_path": {"$prefix": "src/"}}         prefix match (scans the distinct values)
+        {"source": {"$ne": "repo-a"}}              negation (also "$nin")
+        {"$or": [{...}, {...}]}, {"$and": [...]}   combinations
+    """
+
+    def __init__(self, fields: Sequence[str] = FILTER_FIELDS):
+        self.fields = tuple(fields)
+        self.postings = {field: {} for field in self.fields}
+        self.size = 0
+
+    def add(self, metadata: Sequence[Dict[str, Any]], start: int):
+        """Index rows `start:start + len(metadata)`; rows must be added in order."""
+        pending = {field: {} for field in self.fields}
+        for row, item in enumerate(metadata, start):
+            for field in self.fields:
+                value = item.get(field)
+                if value is not None:
+                    pending[field].setdefault(str(value), []).append(row)
+        for field, values in pending.items():
+            postings = self.postings[field]
+            for value, rows in values.items():
+                new_rows = np.asarray(rows, dtype=np.int64)
+                postings[value] = np.concatenate([postings[value], new_rows]) if value in postings else new_rows
+        self.size = max(self.size, start + len(metadata))
+
+    def _field_rows(self, field: str, condition) -> np.ndarray:
+        if field not in self.postings:
+            raise ValueError(f"Cannot filter on '{field}'. Filterable fields: {', '.join(self.fields)}")
+        postings = self.postings[field]
+        if isinstance(condition, dict):
+            if len(condition) != 1:
+                raise ValueError(f"Expected one operator per field condition, got {condition}")
+            (operator, operand), = condition.items()
+            if operator == "$eq":
+                return postings.get(str(operand), _EMPTY)
+            if operator == "$in":
+                return self._union([postings.get(str(value), _EMPTY) for value in operand])
+            if operator == "$prefix":
+                return self._union([rows for value, rows in postings.items() if value.startswith(operand)])
+            if operator == "$ne":
+                return self._complement(postings.get(str(operand), _EMPTY))
+            if operator == "$nin":
+                return self._complement(self._union([postings.get(str(value), _EMPTY) for value in operand]))
+            raise ValueError(f"Unknown filter operator '{operator}'")
+        if isinstance(condition, (list, tuple, set)):
+            return self._union([postings.get(str(value), _EMPTY) for value in condition])
+        return postings.get(str(condition), _EMPTY)
+
+    @staticmethod
+    def _union(parts: List[np.ndarray]) -> np.ndarray:
+        parts = [part for part in parts if part.shape[0]]
+        if not parts:
+            return _EMPTY
+        return parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+
+    @staticmethod
+    def _intersect(parts: List[np.ndarray]) -> np.ndarray:
+        # Smallest list first keeps every step bounded by the most selective condition.
+        parts = sorted(parts, key=lambda part: part.shape[0])
+        result = parts[0]
+        for part in parts[1:]:
+            if not result.shape[0]:
+                break
+            result = np.intersect1d(result, part, assume_unique=True)
+        return result
+
+    def _complement(self, rows: np.ndarray) -> np.ndarray:
+        # Negations are the one case that is O(N).
+        mask = np.ones(self.size, dtype=bool)
+        mask[rows] = False
+        return np.flatnonzero(mask)
+
+    def select(self, expression: Dict[str, Any]) -> np.ndarray:
+        """Sorted rows matching `expression`."""
+        parts = []
+        for key, condition in expression.items():
+            if key == "$and":
+                parts.append(self._intersect([self.select(sub) for sub in condition]))
+            elif key == "$or":
+                parts.append(self._union([self.select(sub) for sub in condition]))
+            else:
+                parts.append(self._field_rows(key, condition))
+        if not parts:
+            return np.arange(self.size, dtype=np.int64)
+        return self._intersect(parts)
+
+    def state_dict(self) -> Dict[str, Any]:
+        # CSR per field: values, offsets into rows, rows.
+        state = {"fields": list(self.fields), "size": self.size}
+        for field in self.fields:
+            values = list(self.postings[field])
+            lists = [self.postings[field][value] for value in values]
+            state[f"{field}__values"] = np.asarray(values, dtype=np.str_)
+            state[f"{field}__offsets"] = np.concatenate(([0], np.cumsum([len(rows) for rows in lists]))).astype(np.int64)
+            state[f"{field}__rows"] = np.concatenate(lists) if lists else _EMPTY
+        return state
+
+    def load_state_dict(self, state: Dict[str, Any]):
+        self.fields = tuple(state["fields"])
+        self.size = state["size"]
+        self.postings = {}
+        for field in self.fields:
+            offsets = state[f"{field}__offsets"]
+            rows = state[f"{field}__rows"]
+            self.postings[field] = {
+                str(value): rows[offsets[i]:offsets[i + 1]] for i, value in enumerate(state[f"{field}__values"])
+            }
+
+
+def metadata_index_from_state(state: Dict[str, Any]) -> MetadataIndex:
+    index = MetadataIndex()
+    index.load_state_dict(state)
+    return index
@@ -0,0 +1,202 @@
+import numpy as np
+from typing import Dict, Any, Optional
+
+
+class ScalarQuantizer:
+    """
+    int8 scalar quantisation: each dimension is mapped linearly from its
+    [min, max] over the training rows onto 256 levels (4x smaller than float32).
+    Scores are asymmetric: the float query is scored against the int8 codes
+    directly, without decoding rows back to float32.
+    """
+
+    kind = "int8"
+
+    def __init__(self):
+        self.low = None
+        self.scale = None
+
+    def train(self, embeddings: np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.low = embeddings.min(axis=0)
+        self.scale = np.maximum(embeddings.max(axis=0) - self.low, 1e-12) / 255.0
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        levels = np.rint((np.asarray(embeddings, dtype=np.float32) - self.low) / self.scale)
+        return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+
+    def inner_products(self, codes: np.ndarray, queries: np.ndarray, block_size: int = 16384) -> np.ndarray:
+        # q . x ~= (q * scale) . code + q . (low + 128 * scale)
+        queries = np.asarray(queries, dtype=np.float32)
+        scaled = queries * self.scale
+        offset = queries @ (self.low + 128 * self.scale)
+        scores = np.empty((queries.shape[0], codes.shape[0]), dtype=np.float32)
+        for start in range(0, codes.shape[0], block_size):
+            block = codes[start:start + block_size].astype(np.float32)
+            scores[:, start:start + block_size] = scaled @ block.T
+        return scores + offset[:, None]
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "low": self.low, "scale": self.scale}
+
+    def load_state_dict(self, state: Dict[str, Any]):
+        self.low = state["low"]
+        self.scale = state["scale"]
+
+
+class ProductQuantizer:
+    """
+    Product quantisation: vectors are split into `n_subvectors` slices and each
+    slice is replaced by the id of its nearest of 256 k-means centroids, so a
+    row costs one byte per slice (32x smaller than float32 with 8-dimension
+    slices). Asymmetric distance: per query, a (slices x 256) table of
+    query-slice . centroid products is built once and each row's score is the
+    sum of its table entries.
+    """
+
+    kind = "pq"
+
+    def __init__(self, n_subvectors: Optional[int] = None, n_centroids: int = 256, n_iter: int = 15,
+                 sample_size: int = 65536, seed: int = 0):
+        self.n_subvectors = n_subvectors
+        self.n_centroids = n_centroids
+        self.n_iter = n_iter
+        self.sample_size = sample_size
+        self.seed = seed
+        self.codebooks = None
+
+    def train(self, embeddings: np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        dim = embeddings.shape[1]
+        if self.n_subvectors is None:
+            self.n_subvectors = max(1, dim // 8)
+        if dim % self.n_subvectors:
+            raise ValueError(f"Embedding dimension {dim} is not divisible by n_subvectors={self.n_subvectors}.")
+        rng = np.random.default_rng(self.seed)
+        sample = embeddings[rng.choice(embeddings.shape[0], min(self.sample_size, embeddings.shape[0]), replace=False)]
+        n_centroids = min(self.n_centroids, sample.shape[0])
+        width = dim // self.n_subvectors
+
+        codebooks = np.empty((self.n_subvectors, n_centroids, width), dtype=np.float32)
+        for j in range(self.n_subvectors):
+            part = sample[:, j * width:(j + 1) * width]
+            centroids = part[rng.choice(part.shape[0], n_centroids, replace=False)].copy()
+            for _ in range(self.n_iter):
+                assignment = self._nearest(part, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, part)
+                counts = np.bincount(assignment, minlength=n_centroids)
+                empty = counts == 0
+                centroids = np.where(empty[:, None], centroids, sums / np.maximum(counts, 1)[:, None])
+            codebooks[j] = centroids
+        self.codebooks = codebooks
+
+    @staticmethod
+    def _nearest(part: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # argmin |x - c|^2 = argmax (x . c - |c|^2 / 2)
+        return np.argmax(part @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+
+    def encode(self, embeddings: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        width = self.codebooks.shape[2]
+        codes = np.empty((embeddings.shape[0], self.n_subvectors), dtype=np.uint8)
+        for start in range(0, embeddings.shape[0], block_size):
+            block = embeddings[start:start + block_size]
+            for j in range(self.n_subvectors):
+                codes[start:start + block_size, j] = self._nearest(block[:, j * width:(j + 1) * width], self.codebooks[j])
+        return codes
+
+    def inner_products(self, codes: np.ndarray, queries: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        queries = np.asarray(queries, dtype=np.float32)
+        n_sub, n_centroids, width = self.codebooks.shape
+        # (queries x slices x centroids) lookup tables
+        tables = np.einsum("qsw,scw->qsc", queries.reshape(queries.shape[0], n_sub, width), self.codebooks)
+        flat_tables = tables.reshape(queries.shape[0], -1)
+        scores = np.empty((queries.shape[0], codes.shape[0]), dtype=np.float32)
+        slice_offsets = np.arange(n_sub) * n_centroids
+        for start in range(0, codes.shape[0], block_size):
+            positions = codes[start:start + block_size].astype(np.int64) + slice_offsets
+            for q in range(queries.shape[0]):
+                scores[q, start:start + block_size] = flat_tables[q][positions].sum(axis=1)
+        return scores
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "n_subvectors": self.n_subvectors,
+            "n_centroids": self.n_centroids,
+            "n_iter": self.n_iter,
+            "sample_size": self.sample_size,
+            "seed": self.seed,
+            "codebooks": self.codebooks,
+        }
+
+    def load_state_dict(self, state: Dict[str, Any]):
+        for key in ("n_subvectors", "n_centroids", "n_iter", "sample_size", "seed"):
+            setattr(self, key, state[key])
+        self.codebooks = state["codebooks"]
+
+
+QUANTIZER_TYPES = {
+    ScalarQuantizer.kind: ScalarQuantizer,
+    ProductQuantizer.kind: ProductQuantizer,
+}
+
+
+class QuantizedMatrix:
+    """
+    Quantised copy of the embedding matrix, used in place of the float32 matrix
+    for candidate scoring: ANN indexes call `inner_products` on it exactly as
+    they would multiply a float array.
+
+    The quantiser is retrained on every row once the matrix reaches
+    `retrain_growth` times the `trained_rows` it was last trained on, so ranges
+    and codebooks fitted to an early batch do not clip everything added later.
+    """
+
+    retrain_growth = 2.0
+
+    def __init__(self, quantizer, codes: Optional[np.ndarray] = None, trained_rows: int = 0):
+        self.quantizer = quantizer
+        self.codes = codes
+        self.trained_rows = trained_rows
+
+    @classmethod
+    def train(cls, kind: str, embeddings: np.ndarray, **params) -> "QuantizedMatrix":
+        if kind not in QUANTIZER_TYPES:
+            raise ValueError(f"Unknown quantization '{kind}'. Expected one of: {', '.join(QUANTIZER_TYPES)}")
+        quantizer = QUANTIZER_TYPES[kind](**params)
+        quantizer.train(embeddings)
+        return cls(quantizer, quantizer.encode(embeddings), int(embeddings.shape[0]))
+
+    @property
+    def kind(self) -> str:
+        return self.quantizer.kind
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    def add(self, embeddings: np.ndarray, start: int):
+        """Encode rows `start:` of `embeddings`, retraining on all of them if the matrix has outgrown its training."""
+        if embeddings.shape[0] >= self.retrain_growth * max(self.trained_rows, 1):
+            self.quantizer.train(embeddings)
+            self.codes = self.quantizer.encode(embeddings)
+            self.trained_rows = int(embeddings.shape[0])
+            return
+        self.codes = np.concatenate([self.codes, self.quantizer.encode(embeddings[start:])])
+
+    def inner_products(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        return self.quantizer.inner_products(self.codes if rows is None else self.codes[rows], queries)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {**self.quantizer.state_dict(), "codes": self.codes, "trained_rows": self.trained_rows}
+
+
+def quantized_from_state(state: Dict[str, Any]) -> QuantizedMatrix:
+    quantizer = QUANTIZER_TYPES[state["kind"]]()
+    quantizer.load_state_dict(state)
+    return QuantizedMatrix(quantizer, state["codes"], int(state["trained_rows"]))
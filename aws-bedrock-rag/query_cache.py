@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).lower()
+
+
+class QueryEmbeddingCache:
+    """
+    LRU cache of query embeddings bounded by entry count and bytes. Keys are the
+    normalised query prefixed with the embedding model, so changing models never
+    serves stale vectors. With `path` set, entries are written through to a SQLite
+    file that other processes on the host can read from; the file is held to the
+    same entry and byte limits, trimmed every `trim_every` writes.
+    """
+
+    def __init__(self, model: str = "voyage-2", max_entries: int = 100_000, max_bytes: int = 256 * 1024 * 1024,
+                 path: Optional[str] = None, trim_every: int = 1000):
+        self.model = model
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.store_evictions = 0
+        self.trim_every = trim_every
+        self._writes = 0
+        self._conn = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def key(self, query: str) -> str:
+        return f"{self.model}\x1f{normalize_query(query)}"
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, query: str) -> bool:
+        return self.get(query, record=False) is not None
+
+    def get(self, query: str, record: bool = True) -> Optional[np.ndarray]:
+        key = self.key(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+            elif self._conn is not None:
+                row = self._conn.execute("SELECT embedding FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    embedding = np.frombuffer(row[0], dtype=np.float32)
+                    self._insert(key, embedding)
+            if record:
+                if embedding is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        return embedding
+
+    def put(self, query: str, embedding):
+        key = self.key(query)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._insert(key, embedding)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, embedding, last_used) VALUES (?, ?, ?)",
+                    (key, embedding.tobytes(), time.time()),
+                )
+                self._conn.commit()
+                self._writes += 1
+                if self._writes % self.trim_every == 0:
+                    self._trim_store()
+
+    def _insert(self, key: str, embedding: np.ndarray):
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key).nbytes + len(key)
+        self._entries[key] = embedding
+        self._bytes += embedding.nbytes + len(key)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            old_key, old_embedding = self._entries.popitem(last=False)
+            self._bytes -= old_embedding.nbytes + len(old_key)
+            self.evictions += 1
+
+    def trim_store(self):
+        """Drop the least recently written rows from the SQLite store beyond `max_entries` or `max_bytes`."""
+        if self._conn is None:
+            return
+        with self._lock:
+            self._trim_store()
+
+    def _trim_store(self):
+        # Newest rows first; a row goes once the rows up to and including it exceed either limit.
+        cursor = self._conn.execute(
+            "DELETE FROM query_embeddings WHERE key IN ("
+            " SELECT key FROM ("
+            "  SELECT key,"
+            "   ROW_NUMBER() OVER (ORDER BY last_used DESC) AS position,"
+            "   SUM(length(embedding) + length(key)) OVER (ORDER BY last_used DESC ROWS UNBOUNDED PRECEDING) AS total"
+            "  FROM query_embeddings"
+            " ) WHERE position > ? OR total > ?"
+            ")",
+            (self.max_entries, self.max_bytes),
+        )
+        self._conn.commit()
+        self.store_evictions += cursor.rowcount
+
+    def to_dict(self) -> Dict[str, List[float]]:
+        with self._lock:
+            return {key: embedding.tolist() for key, embedding in self._entries.items()}
+
+    def load_dict(self, entries: Dict[str, List[float]]):
+        """Restore entries written by `to_dict`; keys carry the model they were embedded with."""
+        with self._lock:
+            for key, embedding in entries.items():
+                self._insert(key, np.asarray(embedding, dtype=np.float32))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "store_evictions": self.store_evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,197 @@
+import time
+import asyncio
+import threading
+from typing import Dict, Any, Awaitable, Callable, Optional
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously. Reservations may go into debt; the caller waits it out."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` from the bucket and return how many seconds to wait before using it."""
+        self._refill()
+        self.available -= min(amount, self.capacity)
+        return -self.available / self.rate if self.available < 0 else 0.0
+
+    def adjust(self, amount: float):
+        """Charge (or, if negative, refund) `amount` against past reservations without waiting."""
+        self._refill()
+        self.available = min(self.capacity, self.available - min(amount, self.capacity))
+
+
+def _resolve(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class AdaptiveRateLimiter:
+    """
+    Shared limiter for API calls made from many threads. The number of calls in
+    flight follows AIMD: it grows by roughly one per window of successes and is
+    cut by `backoff_factor` (with a pause) whenever the provider throttles, so by
+    default the provider's 429s alone set the pace. Requests and tokens per minute
+    can also be capped with token buckets; a call's token reservation is an
+    estimate that `settle` corrects once the real usage is known.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 max_concurrency: int = 32, min_concurrency: int = 1, initial_concurrency: int = 4,
+                 backoff_factor: float = 0.5, default_pause: float = 1.0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(initial_concurrency)
+        self.backoff_factor = backoff_factor
+        self.default_pause = default_pause
+        self.in_flight = 0
+        self.successes = 0
+        self.throttles = 0
+        self.failures = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        # Coroutines parked in `aacquire`, as (loop, future) pairs resolved by `release`.
+        self._async_waiters = []
+
+    def acquire(self, tokens: int = 0):
+        with self._cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0 and self.in_flight < int(self.concurrency):
+                    break
+                self._cond.wait(timeout=pause if pause > 0 else None)
+            self.in_flight += 1
+            wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def _reserve(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = self.requests.reserve(1)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def settle(self, reserved: int, used: int):
+        """Correct a call's token reservation with the tokens it actually used."""
+        if self.tokens is not None:
+            with self._cond:
+                self.tokens.adjust(used - reserved)
+
+    def release(self, throttled: bool = False, retry_after: Optional[float] = None, failed: bool = False):
+        """
+        Free a slot. A throttled call cuts concurrency and pauses new calls; a call
+        that `failed` for any other reason leaves concurrency as it is.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if failed:
+                self.failures += 1
+            elif throttled:
+                self.throttles += 1
+                self.concurrency = max(self.min_concurrency, self.concurrency * self.backoff_factor)
+                pause = retry_after if retry_after is not None else self.default_pause
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            else:
+                self.successes += 1
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            self._cond.notify_all()
+            self._wake_async_waiters()
+
+    def _wake_async_waiters(self):
+        for loop, waiter in self._async_waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_resolve, waiter)
+        self._async_waiters.clear()
+
+    def call(self, fn: Callable[[], Any], tokens: int = 0, is_throttle: Callable[[Exception], bool] = lambda e: False,
+             retry_after: Callable[[Exception], Optional[float]] = lambda e: None, max_retries: int = 8,
+             used_tokens: Optional[Callable[[Any], int]] = None):
+        """
+        Run `fn` under the limiter, retrying throttled attempts after the limiter
+        backs off. `used_tokens` reads the real token count from the result, to
+        `settle` the `tokens` reserved for the call.
+        """
+        for attempt in range(max_retries + 1):
+            self.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_throttle(e):
+                    self.release(failed=True)
+                    raise
+                self.release(throttled=True, retry_after=retry_after(e))
+                if attempt == max_retries:
+                    raise
+                continue
+            self.release()
+            if used_tokens is not None:
+                self.settle(tokens, used_tokens(result))
+            return result
+
+    async def aacquire(self, tokens: int = 0):
+        """`acquire` for coroutines: parks on a future that `release` resolves, so the event loop keeps running."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0 and self.in_flight < int(self.concurrency):
+                    self.in_flight += 1
+                    wait = self._reserve(tokens)
+                    break
+                entry = (loop, loop.create_future())
+                self._async_waiters.append(entry)
+            try:
+                await asyncio.wait([entry[1]], timeout=pause if pause > 0 else None)
+            finally:
+                with self._cond:
+                    if entry in self._async_waiters:
+                        self._async_waiters.remove(entry)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]], tokens: int = 0,
+                    is_throttle: Callable[[Exception], bool] = lambda e: False,
+                    retry_after: Callable[[Exception], Optional[float]] = lambda e: None, max_retries: int = 8,
+                    used_tokens: Optional[Callable[[Any], int]] = None):
+        """`call` for coroutine functions; the limits are shared with threads using `call`."""
+        for attempt in range(max_retries + 1):
+            await self.aacquire(tokens)
+            try:
+                result = await fn()
+            except Exception as e:
+                if not is_throttle(e):
+                    self.release(failed=True)
+                    raise
+                self.release(throttled=True, retry_after=retry_after(e))
+                if attempt == max_retries:
+                    raise
+                continue
+            self.release()
+            if used_tokens is not None:
+                self.settle(tokens, used_tokens(result))
+            return result
+
+    def limits(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "concurrency": int(self.concurrency),
+                "in_flight": self.in_flight,
+                "requests_per_minute": self.requests.capacity if self.requests is not None else None,
+                "tokens_per_minute": self.tokens.capacity if self.tokens is not None else None,
+                "successes": self.successes,
+                "throttles": self.throttles,
+                "failures": self.failures,
+            }
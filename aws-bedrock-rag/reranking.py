@@ -1,7 +1,15 @@
+import os
 import cohere
-from typing import List, Dict, Any, Callable
+import threading
+import numpy as np
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Optional, Tuple, Union
 import json
 from tqdm import tqdm
+from rate_limiter import AdaptiveRateLimiter
+from bm25 import analyze
+from evaluation import DEFAULT_KS, EvaluationSet, print_results, single_or_all
 
 def load_jsonl(file_path: str) -> List[Dict[str, Any]]:
     with open(file_path, 'r') as file:
@@ -9,85 +17,234 @@ def load_jsonl(file_path: str) -> List[Dict[str, Any]]:
 
 def chunk_to_content(chunk: Dict[str, Any]) -> str:
     original_content = chunk['metadata']['original_content']
-    contextualized_content = chunk['metadata']['contextualized_content']
+    contextualized_content = chunk['metadata'].get('contextualized_content')
+    # Chunks from a plain VectorDB have no context.
+    if contextualized_content is None:
+        return original_content
     return f"{original_content}\n\nContext: {contextualized_content}" 
 
-def retrieve_rerank(query: str, db, k: int) -> List[Dict[str, Any]]:
-    co = cohere.Client(os.getenv("COHERE_API_KEY"))
-    
-    # Retrieve more results than we normally would
-    semantic_results = db.search(query, k=k*10)
-    
-    # Extract documents for reranking, using the contextualized content
-    documents = [chunk_to_content(res) for res in semantic_results]
-
-    response = co.rerank(
-        model="rerank-english-v3.0",
-        query=query,
-        documents=documents,
-        top_n=k
-    )
-    time.sleep(0.1)
-    
-    final_results = []
-    for r in response.results:
-        original_result = semantic_results[r.index]
-        final_results.append({
-            "chunk": original_result['metadata'],
-            "score": r.relevance_score
-        })
-    
-    return final_results
+def _is_throttle(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    return status == 429 or type(error).__name__ == "TooManyRequestsError"
 
-def evaluate_retrieval_rerank(queries: List[Dict[str, Any]], retrieval_function: Callable, db, k: int = 20) -> Dict[str, float]:
-    total_score = 0
-    total_queries = len(queries)
-    
-    for query_item in tqdm(queries, desc="Evaluating retrieval"):
-        query = query_item['query']
-        golden_chunk_uuids = query_item['golden_chunk_uuids']
-        
-        golden_contents = []
-        for doc_uuid, chunk_index in golden_chunk_uuids:
-            golden_doc = next((doc for doc in query_item['golden_documents'] if doc['uuid'] == doc_uuid), None)
-            if golden_doc:
-                golden_chunk = next((chunk for chunk in golden_doc['chunks'] if chunk['index'] == chunk_index), None)
-                if golden_chunk:
-                    golden_contents.append(golden_chunk['content'].strip())
-        
-        if not golden_contents:
-            print(f"Warning: No golden contents found for query: {query}")
-            continue
-        
-        retrieved_docs = retrieval_function(query, db, k)
-        
-        chunks_found = 0
-        for golden_content in golden_contents:
-            for doc in retrieved_docs[:k]:
-                retrieved_content = doc['chunk']['original_content'].strip()
-                if retrieved_content == golden_content:
-                    chunks_found += 1
-                    break
-        
-        query_score = chunks_found / len(golden_contents)
-        total_score += query_score
-    
-    average_score = total_score / total_queries
-    pass_at_n = average_score * 100
-    return {
-        "pass_at_n": pass_at_n,
-        "average_score": average_score,
-        "total_queries": total_queries
-    }
-
-def evaluate_db_advanced(db, original_jsonl_path, k):
-    original_data = load_jsonl(original_jsonl_path)
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers["retry-after"]) if "retry-after" in headers else None
+    except (TypeError, ValueError):
+        return None
+
+class Reranker:
+    """
+    Reranker interface. Subclasses implement `score(query, candidates)`; this
+    base class applies the candidate-count cutoff, caches relevance scores per
+    (query, chunk id) so only unscored candidates reach the backend, and runs
+    several queries concurrently in `rerank_many`.
+    """
+
+    def __init__(self, max_candidates: Optional[int] = None, max_concurrency: int = 8, cache_size: int = 1_000_000):
+        self.max_candidates = max_candidates
+        self.max_concurrency = max_concurrency
+        self.cache_size = cache_size
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def chunk_id(result: Dict[str, Any]) -> Tuple[str, int]:
+        return result['metadata']['doc_id'], result['metadata']['original_index']
+
+    def score(self, query: str, candidates: List[Dict[str, Any]]) -> List[float]:
+        """Relevance score of each candidate, in candidate order."""
+        raise NotImplementedError
+
+    def _cached(self, query: str, chunk_ids: List[Tuple[str, int]]) -> Dict[int, float]:
+        found = {}
+        with self._lock:
+            for position, chunk_id in enumerate(chunk_ids):
+                score = self._scores.get((query, chunk_id))
+                if score is not None:
+                    self._scores.move_to_end((query, chunk_id))
+                    found[position] = score
+            self.hits += len(found)
+            self.misses += len(chunk_ids) - len(found)
+        return found
+
+    def _store(self, query: str, scored: Dict[Tuple[str, int], float]):
+        with self._lock:
+            for chunk_id, score in scored.items():
+                self._scores[(query, chunk_id)] = score
+                self._scores.move_to_end((query, chunk_id))
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]], top_n: int) -> List[Tuple[int, float]]:
+        """Return (candidate position, relevance score) for the best `top_n` candidates."""
+        if self.max_candidates is not None:
+            candidates = candidates[:self.max_candidates]
+        if not candidates or top_n <= 0:
+            return []
+        if not self.cache_size:
+            scores = dict(enumerate(self.score(query, candidates)))
+        else:
+            chunk_ids = [self.chunk_id(result) for result in candidates]
+            scores = self._cached(query, chunk_ids)
+            uncached = [position for position in range(len(candidates)) if position not in scores]
+            if uncached:
+                fresh = dict(zip(uncached, self.score(query, [candidates[position] for position in uncached])))
+                self._store(query, {chunk_ids[position]: score for position, score in fresh.items()})
+                scores.update(fresh)
+        # Ties keep retrieval order, so results are deterministic.
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+
+    def rerank_many(self, queries: List[str], candidates: List[List[Dict[str, Any]]], top_n: int,
+                    max_concurrency: Optional[int] = None) -> List[List[Tuple[int, float]]]:
+        """Rerank several queries at once, with at most `max_concurrency` requests in flight."""
+        with ThreadPoolExecutor(max_workers=max_concurrency or self.max_concurrency) as executor:
+            return list(executor.map(lambda pair: self.rerank(pair[0], pair[1], top_n), zip(queries, candidates)))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._scores)}
+
+class CohereReranker(Reranker):
+    """
+    Cohere's hosted reranker with one pooled client shared across threads.
+    Calls are paced by an AdaptiveRateLimiter (which backs off on 429s) instead
+    of a fixed sleep.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, model: str = "rerank-english-v3.0",
+                 rate_limiter: Optional[AdaptiveRateLimiter] = None, max_concurrency: int = 8,
+                 cache_size: int = 1_000_000, max_candidates: Optional[int] = None):
+        super().__init__(max_candidates=max_candidates, max_concurrency=max_concurrency, cache_size=cache_size)
+        self.client = cohere.Client(api_key or os.getenv("COHERE_API_KEY"))
+        self.model = model
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter(
+            requests_per_minute=1000, max_concurrency=max_concurrency, initial_concurrency=max_concurrency
+        )
+
+    def score(self, query: str, candidates: List[Dict[str, Any]]) -> List[float]:
+        # Score every candidate, not just the top few, so the cache stays complete.
+        response = self.rate_limiter.call(
+            lambda: self.client.rerank(
+                model=self.model,
+                query=query,
+                documents=[chunk_to_content(result) for result in candidates],
+                top_n=len(candidates)
+            ),
+            is_throttle=_is_throttle,
+            retry_after=_retry_after,
+        )
+        scores = [0.0] * len(candidates)
+        for r in response.results:
+            scores[r.index] = r.relevance_score
+        return scores
+
+class LexicalReranker(Reranker):
+    """
+    Local, deterministic reranker: BM25 between the query and each candidate's
+    `chunk_to_content` text, with term statistics taken over the candidate list
+    and scored as one NumPy batch. Only the first `max_candidates` retrieval
+    results are considered, and a query with no terms in common with any
+    candidate returns the retrieval order without scoring.
+    """
+
+    def __init__(self, max_candidates: Optional[int] = 100, k1: float = 1.2, b: float = 0.75,
+                 max_concurrency: int = 8, analysis_cache_size: int = 200_000):
+        # Scores depend on the candidate set, so they are not cached across calls.
+        super().__init__(max_candidates=max_candidates, max_concurrency=max_concurrency, cache_size=0)
+        self.k1 = k1
+        self.b = b
+        self.analysis_cache_size = analysis_cache_size
+        self._terms = OrderedDict()
+
+    def _analyzed(self, result: Dict[str, Any]) -> Counter:
+        key = self.chunk_id(result)
+        with self._lock:
+            terms = self._terms.get(key)
+            if terms is not None:
+                self._terms.move_to_end(key)
+                return terms
+        terms = Counter(analyze(chunk_to_content(result)))
+        with self._lock:
+            self._terms[key] = terms
+            while len(self._terms) > self.analysis_cache_size:
+                self._terms.popitem(last=False)
+        return terms
+
+    def score(self, query: str, candidates: List[Dict[str, Any]]) -> List[float]:
+        query_terms = Counter(analyze(query))
+        if not query_terms:
+            return [0.0] * len(candidates)
+        terms = list(query_terms)
+        documents = [self._analyzed(result) for result in candidates]
+        tf = np.array([[document.get(term, 0) for term in terms] for document in documents], dtype=np.float32)
+        if not tf.any():
+            return [0.0] * len(candidates)
+
+        lengths = np.array([sum(document.values()) for document in documents], dtype=np.float32)
+        df = (tf > 0).sum(axis=0)
+        idf = np.log1p((len(candidates) - df + 0.5) / (df + 0.5))
+        norms = self.k1 * (1 - self.b + self.b * lengths / max(float(lengths.mean()), 1.0))
+        weights = tf * (self.k1 + 1) / (tf + norms[:, None])
+        query_tf = np.array([query_terms[term] for term in terms], dtype=np.float32)
+        return (weights @ (idf * query_tf)).tolist()
+
+RERANKERS = {"cohere": CohereReranker, "lexical": LexicalReranker}
+
+_default_rerankers = {}
+_default_reranker_lock = threading.Lock()
+
+def get_reranker(backend: str = "cohere") -> Reranker:
+    """Shared reranker per backend: "cohere" (hosted) or "lexical" (local, offline)."""
+    if backend not in RERANKERS:
+        raise ValueError(f"Unknown reranker backend '{backend}'. Expected one of: {', '.join(RERANKERS)}")
+    with _default_reranker_lock:
+        if backend not in _default_rerankers:
+            _default_rerankers[backend] = RERANKERS[backend]()
+        return _default_rerankers[backend]
+
+def retrieve_rerank(query: str, db, k: int, semantic_results: Optional[List[Dict[str, Any]]] = None,
+                    reranker: Optional[Reranker] = None) -> List[Dict[str, Any]]:
+    reranker = reranker or get_reranker()
     
-    def retrieval_function(query, db, k):
-        return retrieve_rerank(query, db, k)
+    # Retrieve more results than we normally would, unless the caller already did
+    if semantic_results is None:
+        semantic_results = db.search(query, k=k*10)
     
-    results = evaluate_retrieval_rerank(original_data, retrieval_function, db, k)
-    print(f"Pass@{k}: {results['pass_at_n']:.2f}%")
-    print(f"Average Score: {results['average_score']}")
-    print(f"Total queries: {results['total_queries']}")
-    return results
+    return [
+        {"chunk": semantic_results[index]['metadata'], "score": score}
+        for index, score in reranker.rerank(query, semantic_results, top_n=k)
+    ]
+
+def evaluate_retrieval_rerank(queries: List[Dict[str, Any]], retrieval_function: Callable, db, k: Union[int, List[int]] = 20) -> Dict[str, float]:
+    evaluation_set = queries if isinstance(queries, EvaluationSet) else EvaluationSet(queries)
+    ks = [k] if isinstance(k, int) else list(k)
+    rankings = [retrieval_function(query, db, max(ks)) for query in tqdm(evaluation_set.queries, desc="Evaluating retrieval")]
+    return single_or_all(evaluation_set.score(rankings, ks), k)
+
+def evaluate_db_advanced(db, original_jsonl_path, k: Union[int, List[int]] = DEFAULT_KS, reranker: Optional[Reranker] = None,
+                         max_concurrency: int = 8):
+    evaluation_set = EvaluationSet.from_jsonl(original_jsonl_path)
+    reranker = reranker or get_reranker()
+    ks = [k] if isinstance(k, int) else list(k)
+
+    # Fetch every query's rerank candidates in one batched search at the largest
+    # depth. Each k reranks its own k*10 prefix, largest first, so the smaller
+    # prefixes are answered from the reranker's score cache.
+    queries = evaluation_set.queries
+    candidates = db.search_batch(queries, k=max(ks)*10)
+    results = {}
+    for current_k in sorted(ks, reverse=True):
+        prefixes = [semantic_results[:current_k*10] for semantic_results in candidates]
+        ranked = reranker.rerank_many(queries, prefixes, top_n=current_k, max_concurrency=max_concurrency)
+        rankings = [
+            [{"chunk": prefix[index]['metadata'], "score": score} for index, score in order]
+            for prefix, order in zip(prefixes, ranked)
+        ]
+        results.update(evaluation_set.score(rankings, current_k))
+    results = {current_k: results[current_k] for current_k in ks}
+    print_results(results)
+    return single_or_all(results, k)
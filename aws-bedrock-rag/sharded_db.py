@@ -0,0 +1,386 @@
+import os
+import re
+import json
+import heapq
+import queue
+import bisect
+import hashlib
+import argparse
+import itertools
+import threading
+import multiprocessing
+import numpy as np
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.connection import AuthenticationError, Client, Listener
+from typing import List, Dict, Any, Optional, Tuple
+from contextual_vector_db import ContextualVectorDB
+from db_storage import MANIFEST_FILE
+
+FORMAT_VERSION = 1
+SHARDS_FILE = "shards.json"
+AUTHKEY_ENV = "SHARD_AUTHKEY"
+
+
+def shard_for(doc_id: str, n_shards: int) -> int:
+    """Shard of a document: a hash of its doc_id, so the same in every process and run."""
+    digest = hashlib.blake2b(str(doc_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n_shards
+
+
+class _OfflineClient:
+    """Stands in for the API clients of shards opened only to score pre-embedded queries."""
+
+    def __getattr__(self, name):
+        raise RuntimeError("Shard search workers do not call external APIs.")
+
+
+# Shards opened by this process (pool worker or shard server): name -> (version, db).
+_open_shards = {}
+_open_lock = threading.Lock()
+
+
+def _shard_version(db_dir: str) -> Optional[int]:
+    # save_directory swaps in a new directory, so the manifest's mtime changes on every save.
+    try:
+        return os.stat(os.path.join(db_dir, MANIFEST_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _open_shard(name: str, version: int, params: Dict[str, Any]) -> ContextualVectorDB:
+    with _open_lock:
+        cached = _open_shards.get(name)
+        if cached is None or cached[0] != version:
+            db = ContextualVectorDB(name, voyage_client=_OfflineClient(), anthropic_client=_OfflineClient(),
+                                    context_cache_path=None, **params)
+            db.load_db()
+            _open_shards[name] = (version, db)
+        return _open_shards[name][1]
+
+
+def search_shard(name: str, version: int, params: Dict[str, Any], query_embeddings: np.ndarray, k: int,
+                 n_probe: Optional[int], exact: bool, filter: Optional[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Top-k of one shard, opened from disk (memory-mapped) and kept open while its version holds."""
+    db = _open_shard(name, version, params)
+    if not len(db.embeddings):
+        return [[] for _ in query_embeddings]
+    return db.search_embeddings(query_embeddings, k=k, n_probe=n_probe, exact=exact, filter=filter)
+
+
+class ChainedMetadata(Sequence):
+    """Read-only concatenation of the shards' metadata, without copying rows."""
+
+    def __init__(self, parts: List[Sequence]):
+        self.parts = parts
+        self.offsets = list(itertools.accumulate((len(part) for part in parts), initial=0))
+
+    def __len__(self) -> int:
+        return self.offsets[-1]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("metadata index out of range")
+        part = bisect.bisect_right(self.offsets, idx) - 1
+        return self.parts[part][idx - self.offsets[part]]
+
+    def __iter__(self):
+        for part in self.parts:
+            yield from part
+
+
+class ShardClient:
+    """Connections to one shard server (see `serve_shards`), pooled so many threads can search at once."""
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes):
+        self.address = tuple(address)
+        self.authkey = authkey
+        self._idle = queue.LifoQueue()
+
+    def search(self, *request) -> List[List[Dict[str, Any]]]:
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = Client(self.address, authkey=self.authkey)
+        try:
+            connection.send(request)
+            status, payload = connection.recv()
+        except Exception:
+            connection.close()
+            raise
+        self._idle.put(connection)
+        if status == "error":
+            raise payload
+        return payload
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _is_shard_of(name: str, databases: Sequence[str]) -> bool:
+    database, _, shard = name.rpartition("/")
+    return database in databases and re.fullmatch(r"shard_\d{3,}", shard) is not None
+
+
+def _serve_connection(connection, databases: Sequence[str]):
+    with connection:
+        while True:
+            try:
+                request = connection.recv()
+            except EOFError:
+                return
+            try:
+                if not _is_shard_of(request[0], databases):
+                    raise PermissionError(f"This server does not serve shard {request[0]!r}.")
+                connection.send(("ok", search_shard(*request)))
+            except Exception as error:
+                connection.send(("error", error))
+
+
+def serve_shards(address: Tuple[str, int], authkey: bytes, databases: Sequence[str]):
+    """
+    Answer searches of the shards of `databases` over a local socket until
+    interrupted; requests for any other name are refused. Start it from the same
+    working directory as the client; each connection is served on its own thread.
+
+    Requests are pickled, so `authkey` is what keeps other local users from running
+    code in this process: it must be a secret shared only with the clients.
+    """
+    if not authkey:
+        raise ValueError("serve_shards needs a secret authkey.")
+    if not databases:
+        raise ValueError("serve_shards needs the names of the databases to serve.")
+    databases = list(databases)
+    with Listener(tuple(address), authkey=authkey) as listener:
+        print(f"Serving shard searches for {', '.join(databases)} on {address[0]}:{address[1]}")
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, OSError) as error:
+                # A client with the wrong key (or one that hangs up mid-handshake) is dropped, not fatal.
+                print(f"Rejected shard connection: {error}")
+                continue
+            threading.Thread(target=_serve_connection, args=(connection, databases), daemon=True).start()
+
+
+class ShardedContextualVectorDB:
+    """
+    ContextualVectorDB partitioned into `n_shards` databases, each with its own
+    files under ./data/{name}/shard_NNN. Documents are assigned to shards by a
+    hash of their doc_id, so `add_documents` re-ingests and re-saves only the
+    shards that receive new documents.
+
+    Queries are embedded once, then every shard is searched in parallel: by a
+    pool of worker processes (`max_workers`, default one per shard up to the CPU
+    count; 0 searches in-process), or, when `shard_addresses` is given, by shard
+    servers (`python sharded_db.py serve`) over local sockets, authenticated
+    with `authkey` (default: the SHARD_AUTHKEY environment variable). The
+    per-shard top-k lists are merged with a heap. Other keyword arguments are
+    passed to every shard's ContextualVectorDB.
+    """
+
+    def __init__(self, name: str, n_shards: Optional[int] = None, max_workers: Optional[int] = None,
+                 shard_addresses: Optional[List[Tuple[str, int]]] = None, authkey: Optional[bytes] = None,
+                 **db_params):
+        self.name = name
+        self.manifest_path = f"./data/{name}/{SHARDS_FILE}"
+        if os.path.exists(self.manifest_path):
+            saved = self._read_manifest()["n_shards"]
+            if n_shards is not None and n_shards != saved:
+                raise ValueError(f"'{name}' has {saved} shards; resharding to {n_shards} is not supported.")
+            n_shards = saved
+        self.n_shards = n_shards or 4
+        self.max_workers = max_workers
+        if shard_addresses and not authkey:
+            authkey = os.getenv(AUTHKEY_ENV, "").encode()
+            if not authkey:
+                raise ValueError(f"shard_addresses needs an authkey (or the {AUTHKEY_ENV} environment variable).")
+        self.clients = [ShardClient(address, authkey) for address in shard_addresses or []]
+
+        first = ContextualVectorDB(self._shard_name(0), **db_params)
+        # Later shards share the first one's API clients and rate limiter.
+        db_params = {
+            "voyage_client": first.voyage_client,
+            "anthropic_client": first.anthropic_client,
+            "rate_limiter": first.rate_limiter,
+            **db_params,
+        }
+        self.shards = [first] + [ContextualVectorDB(self._shard_name(i), **db_params) for i in range(1, self.n_shards)]
+        # What a worker needs to reopen a shard exactly as it was built.
+        self.search_params = {
+            "index_type": first.index_type,
+            "index_params": first.index_params,
+            "embedding_model": first.embedding_model,
+            "rescore_factor": first.rescore_factor,
+        }
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _shard_name(self, shard_id: int) -> str:
+        return f"{self.name}/shard_{shard_id:03d}"
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        with open(self.manifest_path) as file:
+            manifest = json.load(file)
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported shard manifest version: {manifest.get('format_version')}")
+        return manifest
+
+    def _write_manifest(self):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        with open(self.manifest_path, "w") as file:
+            json.dump({"format_version": FORMAT_VERSION, "n_shards": self.n_shards,
+                       "assignment": "blake2b-64(doc_id) mod n_shards"}, file, indent=2)
+
+    def shard_for(self, doc_id: str) -> int:
+        return shard_for(doc_id, self.n_shards)
+
+    def _loaded(self, shard_id: int) -> ContextualVectorDB:
+        shard = self.shards[shard_id]
+        if not len(shard.metadata) and os.path.exists(shard.db_dir):
+            shard.load_db()
+        return shard
+
+    def load_data(self, dataset: List[Dict[str, Any]], parallel_threads: Optional[int] = None, max_docs_in_flight: int = 8):
+        if os.path.exists(self.manifest_path):
+            print("Loading sharded vector database from disk.")
+            self.load_db()
+            return
+
+        added = self.add_documents(dataset, parallel_threads, max_docs_in_flight=max_docs_in_flight)
+        print(f"Sharded vector database loaded and saved. Total chunks processed: {added} across {self.n_shards} shards")
+
+    def add_documents(self, dataset: List[Dict[str, Any]], parallel_threads: Optional[int] = None,
+                      max_docs_in_flight: int = 8) -> int:
+        """Add new chunks of `dataset`; only the shards its documents map to are touched. Returns the number added."""
+        groups = {}
+        for doc in dataset:
+            groups.setdefault(self.shard_for(doc['doc_id']), []).append(doc)
+        added = 0
+        for shard_id in sorted(groups):
+            added += self.shards[shard_id].add_documents(groups[shard_id], parallel_threads, max_docs_in_flight)
+        self._write_manifest()
+        return added
+
+    def save_db(self):
+        for shard in self.shards:
+            if len(shard.metadata):
+                shard.save_db()
+        self._write_manifest()
+
+    def load_db(self):
+        """Check the shard manifest; shards are opened lazily by whichever process searches them."""
+        if not os.path.exists(self.manifest_path):
+            raise ValueError("Sharded vector database not found. Use load_data to create a new database.")
+        self._read_manifest()
+
+    @property
+    def metadata(self) -> ChainedMetadata:
+        return ChainedMetadata([self._loaded(i).metadata for i in range(self.n_shards)])
+
+    def get_chunk(self, doc_id: str, original_index: int) -> Optional[Dict[str, Any]]:
+        return self._loaded(self.shard_for(doc_id)).get_chunk(doc_id, original_index)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        # Queries go through the first shard's query cache and embedding client.
+        return self.shards[0].embed_queries(queries)
+
+    def search(self, query: str, k: int = 20, n_probe: Optional[int] = None, exact: bool = False,
+               filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        return self.search_batch([query], k=k, n_probe=n_probe, exact=exact, filter=filter)[0]
+
+    def search_batch(self, queries: List[str], k: int = 20, n_probe: Optional[int] = None,
+                     exact: bool = False, filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        return self.search_embeddings(self.embed_queries(queries), k=k, n_probe=n_probe, exact=exact, filter=filter)
+
+    def search_embeddings(self, query_embeddings: np.ndarray, k: int = 20, n_probe: Optional[int] = None,
+                          exact: bool = False, filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Top-k over all shards: each shard returns its own top-k and the sorted lists are heap-merged."""
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        requests = []
+        for shard_id in self._shards_for_filter(filter):
+            version = _shard_version(self.shards[shard_id].db_dir)
+            if version is not None:
+                requests.append((shard_id, (self.shards[shard_id].name, version, self.search_params,
+                                            query_embeddings, k, n_probe, exact, filter)))
+        if not requests and not os.path.exists(self.manifest_path):
+            raise ValueError("No data loaded in the vector database.")
+
+        per_shard = self._run(requests)
+        return [
+            list(itertools.islice(
+                heapq.merge(*(results[q] for results in per_shard), key=lambda item: item["similarity"], reverse=True),
+                k,
+            ))
+            for q in range(query_embeddings.shape[0])
+        ]
+
+    def _shards_for_filter(self, filter: Optional[Dict[str, Any]]) -> List[int]:
+        # A doc_id condition names the only shards that can hold matching rows.
+        condition = (filter or {}).get("doc_id")
+        if isinstance(condition, dict) and len(condition) == 1:
+            operator, operand = next(iter(condition.items()))
+            condition = operand if operator in ("$eq", "$in") else None
+        if condition is None or isinstance(condition, dict):
+            return list(range(self.n_shards))
+        doc_ids = condition if isinstance(condition, (list, tuple, set)) else [condition]
+        return sorted({self.shard_for(doc_id) for doc_id in doc_ids})
+
+    def _run(self, requests: List[Tuple[int, tuple]]) -> List[List[List[Dict[str, Any]]]]:
+        if self.clients:
+            executor = self._get_executor(lambda: ThreadPoolExecutor(max_workers=self.n_shards))
+            futures = [executor.submit(self.clients[shard_id % len(self.clients)].search, *request)
+                       for shard_id, request in requests]
+        elif self.max_workers == 0:
+            return [search_shard(*request) for _, request in requests]
+        else:
+            # spawn: the parent runs thread pools, which do not survive fork safely.
+            executor = self._get_executor(lambda: ProcessPoolExecutor(
+                max_workers=self.max_workers or min(self.n_shards, os.cpu_count() or 1),
+                mp_context=multiprocessing.get_context("spawn"),
+            ))
+            futures = [executor.submit(search_shard, *request) for _, request in requests]
+        return [future.result() for future in futures]
+
+    def _get_executor(self, create):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = create()
+            return self._executor
+
+    def close(self):
+        """Stop the search workers and close shard server connections."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        for client in self.clients:
+            client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve ContextualVectorDB shard searches over a local socket.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=6100)
+    serve.add_argument("--name", dest="names", action="append", required=True,
+                       help="Sharded database whose shards to serve; repeat for several.")
+    serve.add_argument("--authkey", default=os.getenv(AUTHKEY_ENV),
+                       help=f"Shared secret for clients (default: ${AUTHKEY_ENV}).")
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error(f"an authkey is required: pass --authkey or set {AUTHKEY_ENV}.")
+    serve_shards((args.host, args.port), args.authkey.encode(), args.names)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Recall of the IVF index and the quantised matrices against exact search, on the
+deterministic synthetic corpus and feature-hashing embedder from benchmark.py.
+
+    python -m pytest test_ann_recall.py
+"""
+import numpy as np
+import pytest
+from benchmark import HashEmbedder, synthetic_corpus, synthetic_evaluation_set
+from ann_index import IVFFlatIndex, measure_recall
+from embedding_store import l2_normalize
+from vector_db import VectorDB
+
+N_CHUNKS = 2000
+DIM = 64
+K = 10
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    documents = list(synthetic_corpus(N_CHUNKS))
+    queries = [item["query"] for item in synthetic_evaluation_set(N_CHUNKS, 50)]
+    embedder = HashEmbedder(DIM)
+    embeddings = l2_normalize(embedder.embed([chunk["content"] for doc in documents for chunk in doc["chunks"]]).embeddings)
+    query_embeddings = l2_normalize(embedder.embed(queries).embeddings)
+    return documents, queries, embeddings, query_embeddings
+
+
+def _recall(db: VectorDB, queries, k: int = K) -> float:
+    found = db.search_batch(queries, k=k)
+    expected = db.search_batch(queries, k=k, exact=True)
+    return float(np.mean([
+        len({r["metadata"]["chunk_id"] for r in a} & {r["metadata"]["chunk_id"] for r in b}) / k
+        for a, b in zip(found, expected)
+    ]))
+
+
+def test_ivf_recall(corpus):
+    _, _, embeddings, query_embeddings = corpus
+    index = IVFFlatIndex()
+    index.build(embeddings)
+    assert measure_recall(index, embeddings, query_embeddings, k=K) >= 0.85
+
+
+def test_ivf_rebuilds_as_it_grows(corpus):
+    _, _, embeddings, query_embeddings = corpus
+    built = IVFFlatIndex()
+    built.build(embeddings)
+    grown = IVFFlatIndex()
+    grown.build(embeddings[:8])
+    grown.add(embeddings, 8)
+    # Trained on the first 8 rows alone it would keep 2 lists and scan everything.
+    assert grown.centroids.shape[0] == built.centroids.shape[0]
+    assert grown.trained_rows == embeddings.shape[0]
+    assert measure_recall(grown, embeddings, query_embeddings, k=K) >= 0.85
+
+
+@pytest.mark.parametrize("quantization, min_recall", [("int8", 0.85), ("pq", 0.5)])
+def test_quantized_recall_after_add_documents(corpus, tmp_path, monkeypatch, quantization, min_recall):
+    documents, queries, _, _ = corpus
+    monkeypatch.chdir(tmp_path)
+    db = VectorDB("recall", index_type="ivf", quantization=quantization, rescore_factor=2,
+                  voyage_client=HashEmbedder(DIM))
+    db.load_data(documents[:1])
+    db.add_documents(documents[1:])
+    assert _recall(db, queries) >= min_recall
+
+    reloaded = VectorDB("recall", index_type="ivf", voyage_client=HashEmbedder(DIM))
+    reloaded.load_db()
+    assert reloaded.quantized.trained_rows == N_CHUNKS
+    assert _recall(reloaded, queries) >= min_recall
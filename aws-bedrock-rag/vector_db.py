@@ -3,3 +3,563 @@ import pickle
 import json
 import numpy as np
 import voyageai
+import asyncio
+import queue
+import threading
+import weakref
+from typing import List, Dict, Any, Optional
+from tqdm import tqdm
+from ann_index import FlatIndex, create_index, index_from_state, inner_products, top_k, top_k_rows
+from embedding_store import EmbeddingMatrix, l2_normalize
+from db_storage import save_directory, load_directory
+from query_cache import QueryEmbeddingCache
+from ingest_journal import IngestJournal, chunk_key
+from context_scheduler import DocumentScheduler
+from quantization import QuantizedMatrix, quantized_from_state
+from metadata_index import MetadataIndex, metadata_index_from_state
+
+
+class VectorDB:
+    """
+    Chunk embedding database: a float32 matrix (memory-mapped once saved) with
+    per-row metadata, an optional ANN index and quantised copy, metadata filters
+    and a query embedding cache. Chunks are embedded as they are;
+    ContextualVectorDB extends it by situating each chunk in its document first,
+    so both share this storage, ingest and search code.
+    """
+
+    # Directory under ./data/{name}/ that holds the saved database.
+    storage_name = "vector_db"
+    display_name = "Vector database"
+
+    def __init__(self, name: str, voyage_api_key=None,
+                 index_type: str = "flat", index_params: Optional[Dict[str, Any]] = None,
+                 embedding_model: str = "voyage-2", query_cache_size: int = 100_000,
+                 query_cache_bytes: int = 256 * 1024 * 1024, query_cache_path: Optional[str] = None,
+                 voyage_client=None, quantization: Optional[str] = None,
+                 quantization_params: Optional[Dict[str, Any]] = None, rescore_factor: int = 10,
+                 async_voyage_client=None, max_async_requests: int = 256):
+        if voyage_api_key is None:
+            voyage_api_key = os.getenv("VOYAGE_API_KEY")
+
+        # Clients can be injected, e.g. the local stand-ins in benchmark.py.
+        self.voyage_client = voyage_client or voyageai.Client(api_key=voyage_api_key)
+        # Async client for the a* methods, created on first use.
+        self._async_voyage_client = async_voyage_client
+        self._voyage_api_key = voyage_api_key
+        # Provider requests in flight per event loop across asearch/aload_data calls.
+        self.max_async_requests = max_async_requests
+        self._async_semaphores = weakref.WeakKeyDictionary()
+        self.name = name
+        self._matrix = EmbeddingMatrix()
+        self.metadata = []
+        # (doc_id, original_index) -> row, kept in step with metadata.
+        self.row_lookup = {}
+        # Posting lists over doc_id, original_uuid, source and file_path for filtered search.
+        self.metadata_index = MetadataIndex()
+        self.embedding_model = embedding_model
+        # query_cache_path points at a SQLite file that several processes may share.
+        self.query_cache = QueryEmbeddingCache(
+            model=embedding_model, max_entries=query_cache_size, max_bytes=query_cache_bytes, path=query_cache_path
+        )
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        self.index = None
+        # "int8" or "pq": candidates are scored against quantised codes and the best
+        # k * rescore_factor are re-scored exactly from the memory-mapped float32 matrix.
+        self.quantization = quantization
+        self.quantization_params = quantization_params or {}
+        self.rescore_factor = rescore_factor
+        self.quantized = None
+        self.db_dir = f"./data/{name}/{self.storage_name}"
+        # Pickle format written before the directory layout; still readable.
+        self.db_path = f"./data/{name}/{self.storage_name}.pkl"
+        # Namespaced like db_dir, so a VectorDB never resumes a ContextualVectorDB's work.
+        self.journal_dir = f"./data/{name}/{self.storage_name}_journal"
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self._matrix.array
+
+    @property
+    def async_voyage_client(self):
+        if self._async_voyage_client is None:
+            self._async_voyage_client = voyageai.AsyncClient(api_key=self._voyage_api_key)
+        return self._async_voyage_client
+
+    def _async_semaphore(self) -> asyncio.Semaphore:
+        # One per event loop: asyncio primitives cannot be shared between loops.
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._async_semaphores[loop] = asyncio.Semaphore(self.max_async_requests)
+        return semaphore
+
+    async def _aembed(self, texts: List[str]):
+        async with self._async_semaphore():
+            response = await self.async_voyage_client.embed(texts, model=self.embedding_model)
+        return response.embeddings
+
+    def load_data(self, dataset: List[Dict[str, Any]], parallel_threads: Optional[int] = None, max_docs_in_flight: int = 8):
+        if len(self.embeddings) and self.metadata:
+            print("Vector database is already loaded. Skipping data loading.")
+            return
+        if os.path.exists(self.db_dir) or os.path.exists(self.db_path):
+            print("Loading vector database from disk.")
+            self.load_db()
+            return
+
+        self._ingest(dataset, parallel_threads, max_docs_in_flight=max_docs_in_flight)
+        print(f"{self.display_name} loaded and saved. Total chunks processed: {len(self.metadata)}")
+        self._print_ingest_summary()
+
+    def add_documents(self, dataset: List[Dict[str, Any]], parallel_threads: Optional[int] = None,
+                      max_docs_in_flight: int = 8) -> int:
+        """
+        Prepare (see `_prepare_chunk`) and embed only the chunks of `dataset` that are
+        not already in the database, append them, and save. Returns the number of chunks added.
+        """
+        if not len(self.embeddings) and (os.path.exists(self.db_dir) or os.path.exists(self.db_path)):
+            self.load_db()
+        added = self._ingest(dataset, parallel_threads, max_docs_in_flight=max_docs_in_flight)
+        print(f"Added {added} chunks. Total chunks in database: {len(self.metadata)}")
+        self._print_ingest_summary()
+        return added
+
+    async def aload_data(self, dataset: List[Dict[str, Any]], max_docs_in_flight: int = 8):
+        """Async load_data: the same checkpointed ingest, driven by the async clients."""
+        if len(self.embeddings) and self.metadata:
+            print("Vector database is already loaded. Skipping data loading.")
+            return
+        if os.path.exists(self.db_dir) or os.path.exists(self.db_path):
+            print("Loading vector database from disk.")
+            await asyncio.to_thread(self.load_db)
+            return
+
+        await self._aingest(dataset, max_docs_in_flight=max_docs_in_flight)
+        print(f"{self.display_name} loaded and saved. Total chunks processed: {len(self.metadata)}")
+        self._print_ingest_summary()
+
+    def _print_ingest_summary(self):
+        """Statistics printed after an ingest; ContextualVectorDB adds its token usage."""
+        print(f"Query cache: {self.query_cache.stats()}")
+
+    def _plan_ingest(self, dataset: List[Dict[str, Any]], contexts: Dict[str, Any]):
+        """Keys of the chunks not yet in the database, and the (doc, chunk) pairs still to prepare."""
+        new_keys = []
+        pending = []
+        for doc in dataset:
+            for chunk in doc['chunks']:
+                key = chunk_key(doc['doc_id'], chunk['original_index'])
+                if key in self.row_lookup:
+                    continue
+                new_keys.append(key)
+                if key not in contexts:
+                    pending.append((doc, chunk))
+        return new_keys, pending
+
+    @staticmethod
+    def _chunk_result(doc: Dict[str, Any], chunk: Dict[str, Any],
+                      contextualized_text: Optional[str] = None) -> Dict[str, Any]:
+        # Without a context the chunk is embedded as it is.
+        result = {
+            'text_to_embed': chunk['content'] if contextualized_text is None else f"{chunk['content']}\n\n{contextualized_text}",
+            'metadata': {
+                'doc_id': doc['doc_id'],
+                'original_uuid': doc['original_uuid'],
+                'chunk_id': chunk['chunk_id'],
+                'original_index': chunk['original_index'],
+                'original_content': chunk['content'],
+            }
+        }
+        if contextualized_text is not None:
+            result['metadata']['contextualized_content'] = contextualized_text
+        # Optional provenance, used by metadata filters.
+        for field in ('source', 'file_path'):
+            value = chunk.get(field, doc.get(field))
+            if value is not None:
+                result['metadata'][field] = value
+        return result
+
+    def _journal_dim(self) -> Optional[int]:
+        # Resumed vectors must also fit the rows already in the matrix.
+        return self.embeddings.shape[1] if len(self.embeddings) else None
+
+    def _ingest_threads(self, parallel_threads: Optional[int]) -> int:
+        return parallel_threads or 1
+
+    def _prepare_chunk(self, doc: Dict[str, Any], chunk: Dict[str, Any], journal: IngestJournal) -> Dict[str, Any]:
+        """Text to embed and metadata for one chunk. Free here, so nothing is journaled."""
+        return self._chunk_result(doc, chunk)
+
+    async def _aprepare_chunk(self, doc: Dict[str, Any], chunk: Dict[str, Any], journal: IngestJournal) -> Dict[str, Any]:
+        return self._chunk_result(doc, chunk)
+
+    def _ingest(self, dataset: List[Dict[str, Any]], parallel_threads: Optional[int], max_docs_in_flight: int = 8,
+                embed_queue_size: int = 1024) -> int:
+        """
+        Checkpointed, streaming ingest. Workers preparing chunks (`_prepare_chunk`)
+        feed a bounded queue that an embedding thread drains in 128-item batches, so
+        both stages overlap. Chunks are scheduled per document (see DocumentScheduler)
+        so a contextualising subclass hits the document's prompt cache. Every paid-for
+        context and every embedded batch is journaled as soon as it is produced, so a
+        restarted run only redoes work that never reached the journal. Chunks already
+        in the database are skipped.
+        """
+        batch_size = 128
+        parallel_threads = self._ingest_threads(parallel_threads)
+        journal = IngestJournal(self.journal_dir)
+        existing = self.row_lookup
+        contexts = journal.contexts()
+        new_keys, pending = self._plan_ingest(dataset, contexts)
+
+        embedded = journal.embedded(self.embedding_model, self._journal_dim())
+        embed_queue = queue.Queue(maxsize=embed_queue_size)
+        embed_errors = []
+
+        def embed_stage():
+            # Consumes keys of prepared chunks and embeds them 128 at a time
+            # while preparation is still running. After a failure it keeps
+            # draining the queue so producers never block on a dead consumer.
+            keys = []
+            while True:
+                key = embed_queue.get()
+                if key is not None:
+                    keys.append(key)
+                if keys and (len(keys) == batch_size or key is None) and not embed_errors:
+                    try:
+                        vectors = self.voyage_client.embed(
+                            [contexts[key]['text_to_embed'] for key in keys],
+                            model=self.embedding_model
+                        ).embeddings
+                        journal.append_embeddings(keys, vectors, self.embedding_model)
+                        embedded.update(zip(keys, np.asarray(vectors, dtype=np.float32)))
+                    except Exception as e:
+                        embed_errors.append(e)
+                if keys and (len(keys) == batch_size or key is None):
+                    keys = []
+                if key is None:
+                    return
+
+        embed_thread = threading.Thread(target=embed_stage, name=f"{self.name}-embed", daemon=True)
+        embed_thread.start()
+
+        def prepare_and_enqueue(doc, chunk):
+            key = chunk_key(doc['doc_id'], chunk['original_index'])
+            contexts[key] = self._prepare_chunk(doc, chunk, journal)
+            # Unjournaled (free) preparations are redone on resume; their embeddings are not.
+            if key not in embedded:
+                embed_queue.put(key)
+
+        print(f"Processing {len(pending)} chunks with {parallel_threads} threads "
+              f"({len(new_keys) - len(pending)} resumed from journal, {len(existing)} already in database)")
+        try:
+            # Chunks prepared by an earlier run go straight to the embed stage.
+            for key in new_keys:
+                if key in contexts and key not in embedded:
+                    embed_queue.put(key)
+            scheduler = DocumentScheduler(parallel_threads, max_docs_in_flight=max_docs_in_flight)
+            with tqdm(total=len(pending), desc="Processing chunks") as progress:
+                scheduler.run(pending, prepare_and_enqueue, on_chunk_done=lambda: progress.update(1))
+        finally:
+            embed_queue.put(None)
+            embed_thread.join()
+        if embed_errors:
+            raise embed_errors[0]
+
+        # Rows follow the dataset's (doc_id, chunk index) order, not completion order,
+        # so the same dataset always builds the same matrix.
+        if new_keys:
+            self._append_rows(
+                np.stack([embedded[key] for key in new_keys]),
+                [contexts[key]['metadata'] for key in new_keys],
+            )
+        self.save_db()
+        journal.clear()
+        return len(new_keys)
+
+    async def _aingest(self, dataset: List[Dict[str, Any]], max_docs_in_flight: int = 8) -> int:
+        """
+        Coroutine counterpart of `_ingest`. Each document's first chunk is prepared
+        first, then the rest concurrently, with `max_docs_in_flight` documents
+        active; each full batch of 128 prepared chunks is embedded as soon as it
+        fills. Journal writes, row appends and the save run on worker threads.
+        """
+        batch_size = 128
+        journal = IngestJournal(self.journal_dir)
+        contexts = journal.contexts()
+        embedded = journal.embedded(self.embedding_model, self._journal_dim())
+        new_keys, pending = self._plan_ingest(dataset, contexts)
+        document_slots = asyncio.Semaphore(max_docs_in_flight)
+        embed_tasks = []
+        batch = [key for key in new_keys if key in contexts and key not in embedded]
+
+        async def embed_batch(keys):
+            vectors = await self._aembed([contexts[key]['text_to_embed'] for key in keys])
+            await asyncio.to_thread(journal.append_embeddings, keys, vectors, self.embedding_model)
+            embedded.update(zip(keys, np.asarray(vectors, dtype=np.float32)))
+
+        def flush():
+            for i in range(0, len(batch), batch_size):
+                embed_tasks.append(asyncio.create_task(embed_batch(batch[i : i + batch_size])))
+            batch.clear()
+
+        async def prepare(doc, chunk):
+            key = chunk_key(doc['doc_id'], chunk['original_index'])
+            contexts[key] = await self._aprepare_chunk(doc, chunk, journal)
+            if key not in embedded:
+                batch.append(key)
+            if len(batch) >= batch_size:
+                flush()
+
+        async def run_document(doc, chunks):
+            # The first chunk writes the document's prompt cache entry; the rest read it.
+            async with document_slots:
+                await prepare(doc, chunks[0])
+                await asyncio.gather(*(prepare(doc, chunk) for chunk in chunks[1:]))
+
+        print(f"Processing {len(pending)} chunks with up to {self.max_async_requests} concurrent requests "
+              f"({len(new_keys) - len(pending)} resumed from journal, {len(self.row_lookup)} already in database)")
+        try:
+            if len(batch) >= batch_size:
+                flush()
+            # A TaskGroup cancels the other documents as soon as one fails.
+            async with asyncio.TaskGroup() as documents:
+                for doc, chunks in DocumentScheduler.group_by_document(pending):
+                    documents.create_task(run_document(doc, chunks))
+            flush()
+        except BaseExceptionGroup as group:
+            raise group.exceptions[0]
+        finally:
+            # Let embeddings already started reach the journal, even after a failure.
+            results = await asyncio.gather(*embed_tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        if new_keys:
+            await asyncio.to_thread(
+                self._append_rows,
+                np.stack([embedded[key] for key in new_keys]),
+                [contexts[key]['metadata'] for key in new_keys],
+            )
+        await asyncio.to_thread(self.save_db)
+        journal.clear()
+        return len(new_keys)
+
+    def _append_rows(self, vectors: np.ndarray, metadata: List[Dict[str, Any]]):
+        start = len(self._matrix)
+        self._matrix.append(vectors)
+        if not isinstance(self.metadata, list):
+            # Metadata opened from disk is read-only; materialise it before appending.
+            self.metadata = list(self.metadata)
+        self.metadata.extend(metadata)
+        for row, item in enumerate(metadata, start):
+            self.row_lookup[chunk_key(item['doc_id'], item['original_index'])] = row
+        self.metadata_index.add(metadata, start)
+        if self.index is None or start == 0:
+            self._build_index()
+        else:
+            self.index.add(self.embeddings, start)
+        if self.quantization is not None:
+            if self.quantized is None or start == 0:
+                self._build_quantized()
+            else:
+                self.quantized.add(self.embeddings, start)
+
+    def _build_index(self):
+        self.index = create_index(self.index_type, **self.index_params)
+        self.index.build(self.embeddings)
+
+    def _build_quantized(self):
+        self.quantized = QuantizedMatrix.train(self.quantization, self.embeddings, **self.quantization_params)
+
+    def _lookup_queries(self, queries: List[str]):
+        """Cached embeddings by cache key, and the distinct queries that missed the cache."""
+        found = {}
+        missing = {}
+        for query in queries:
+            key = self.query_cache.key(query)
+            if key in found or key in missing:
+                continue
+            embedding = self.query_cache.get(query)
+            if embedding is None:
+                missing[key] = query
+            else:
+                found[key] = embedding
+        return found, list(missing.values())
+
+    def _store_queries(self, queries: List[str], embeddings, found: Dict[str, Any]):
+        for query, embedding in zip(queries, embeddings):
+            self.query_cache.put(query, embedding)
+            found[self.query_cache.key(query)] = embedding
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed queries through the query cache, sending cache misses in 128-wide batches."""
+        batch_size = 128
+        found, missing_queries = self._lookup_queries(queries)
+        for i in range(0, len(missing_queries), batch_size):
+            batch = missing_queries[i : i + batch_size]
+            self._store_queries(batch, self.voyage_client.embed(batch, model=self.embedding_model).embeddings, found)
+        return l2_normalize([found[self.query_cache.key(query)] for query in queries])
+
+    def search(self, query: str, k: int = 20, n_probe: Optional[int] = None, exact: bool = False,
+               filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Return the top-k chunks for `query`. `n_probe` trades recall for latency on an
+        IVF index; `exact=True` bypasses the ANN index and scores every row. `filter`
+        is a metadata filter expression (see MetadataIndex); only matching rows are scored.
+        """
+        return self.search_batch([query], k=k, n_probe=n_probe, exact=exact, filter=filter)[0]
+
+    def search_batch(self, queries: List[str], k: int = 20, n_probe: Optional[int] = None,
+                     exact: bool = False, filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Top-k chunks for each query, scored against the corpus in one pass."""
+        if not len(self.embeddings):
+            raise ValueError("No data loaded in the vector database.")
+
+        return self.search_embeddings(self.embed_queries(queries), k=k, n_probe=n_probe, exact=exact, filter=filter)
+
+    def search_embeddings(self, query_embeddings: np.ndarray, k: int = 20, n_probe: Optional[int] = None,
+                          exact: bool = False, filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Top-k chunks for already-embedded (normalised) queries, one row per query."""
+        if not len(self.embeddings):
+            raise ValueError("No data loaded in the vector database.")
+
+        index = FlatIndex() if exact or self.index is None else self.index
+        if filter is not None:
+            results = self._search_filtered(query_embeddings, k, exact, self.metadata_index.select(filter))
+        elif self.quantized is not None and not exact:
+            candidates = index.search_batch(self.quantized, query_embeddings, k * self.rescore_factor, n_probe=n_probe)
+            results = [self._rescore(rows, query, k) for (rows, _), query in zip(candidates, query_embeddings)]
+        else:
+            results = index.search_batch(self.embeddings, query_embeddings, k, n_probe=n_probe)
+
+        return [
+            [
+                {
+                    "metadata": self.metadata[idx],
+                    "similarity": float(similarity),
+                }
+                for idx, similarity in zip(top_indices, similarities)
+            ]
+            for top_indices, similarities in results
+        ]
+
+    def _search_filtered(self, query_embeddings: np.ndarray, k: int, exact: bool, rows: np.ndarray):
+        # Pre-filtered: only the eligible rows are scored, brute force, so the cost
+        # is O(matching rows) whatever the index type.
+        if not rows.shape[0]:
+            return [(rows, np.empty(0, dtype=np.float32)) for _ in query_embeddings]
+        quantized = self.quantized is not None and not exact
+        depth = k * self.rescore_factor if quantized else k
+        similarities = inner_products(self.quantized if quantized else self.embeddings, query_embeddings, rows)
+        top = top_k_rows(similarities, depth)
+        if quantized:
+            return [self._rescore(rows[order], query, k) for order, query in zip(top, query_embeddings)]
+        return [(rows[order], scores[order]) for order, scores in zip(top, similarities)]
+
+    def _rescore(self, rows: np.ndarray, query: np.ndarray, k: int):
+        # Exact float32 scores for the quantised candidates; rows are read in file
+        # order so the memory-mapped matrix is touched sequentially.
+        rows = np.sort(rows)
+        similarities = self.embeddings[rows] @ query
+        order = top_k(similarities, k)
+        return rows[order], similarities[order]
+
+    async def aembed_queries(self, queries: List[str]) -> np.ndarray:
+        """Async embed_queries: cache misses are sent as concurrent 128-wide batches; cache I/O runs on a worker thread."""
+        batch_size = 128
+        found, missing_queries = await asyncio.to_thread(self._lookup_queries, queries)
+        batches = [missing_queries[i : i + batch_size] for i in range(0, len(missing_queries), batch_size)]
+        if batches:
+            embedded = await asyncio.gather(*(self._aembed(batch) for batch in batches))
+            await asyncio.to_thread(self._store_queries, missing_queries, [e for batch in embedded for e in batch], found)
+        return l2_normalize([found[self.query_cache.key(query)] for query in queries])
+
+    async def asearch(self, query: str, k: int = 20, n_probe: Optional[int] = None, exact: bool = False,
+                      filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Async search; see `asearch_batch`."""
+        return (await self.asearch_batch([query], k=k, n_probe=n_probe, exact=exact, filter=filter))[0]
+
+    async def asearch_batch(self, queries: List[str], k: int = 20, n_probe: Optional[int] = None,
+                            exact: bool = False, filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Async search_batch for asyncio services. Queries are embedded with the async
+        Voyage client, while query-cache lookups and scoring run on worker threads
+        (NumPy releases the GIL), so many searches can be in flight at once.
+        """
+        if not len(self.embeddings):
+            raise ValueError("No data loaded in the vector database.")
+
+        query_embeddings = await self.aembed_queries(queries)
+        return await asyncio.to_thread(self.search_embeddings, query_embeddings, k, n_probe, exact, filter)
+
+    def get_chunk(self, doc_id: str, original_index: int) -> Optional[Dict[str, Any]]:
+        """Metadata of the chunk with this (doc_id, original_index), in O(1)."""
+        row = self.row_lookup.get(chunk_key(doc_id, original_index))
+        return self.metadata[row] if row is not None else None
+
+    def save_db(self):
+        self.query_cache.trim_store()
+        os.makedirs(os.path.dirname(self.db_dir), exist_ok=True)
+        save_directory(
+            self.db_dir,
+            self.embeddings,
+            self.metadata,
+            self.query_cache.to_dict(),
+            index_state=self.index.state_dict() if self.index is not None else None,
+            quantization_state=self.quantized.state_dict() if self.quantized is not None else None,
+            metadata_index_state=self.metadata_index.state_dict(),
+        )
+
+    def load_db(self):
+        """
+        Open the database from disk. Embeddings are memory-mapped read-only and
+        metadata rows are decoded on demand, so processes sharing a host share the
+        page-cached files instead of each holding a private copy.
+        """
+        if os.path.exists(self.db_dir):
+            data = load_directory(self.db_dir)
+            self._matrix = EmbeddingMatrix.wrap(data["embeddings"])
+            self.metadata = data["metadata"]
+            self.query_cache.load_dict(data["query_cache"])
+            self.row_lookup = {chunk_key(*key): row for row, key in enumerate(data["chunk_keys"])}
+            self.metadata_index = metadata_index_from_state(data["metadata_index"])
+            index_state = data["index"]
+            quantization_state = data["quantization"]
+        elif os.path.exists(self.db_path):
+            with open(self.db_path, "rb") as file:
+                data = pickle.load(file)
+            # Older databases pickled the embeddings as a list of lists.
+            self._matrix = EmbeddingMatrix.from_array(np.asarray(data["embeddings"], dtype=np.float32))
+            # Pickled base databases stored the chunk text as 'content'.
+            self.metadata = [
+                item if 'original_content' in item else {**item, 'original_content': item.get('content', '')}
+                for item in data["metadata"]
+            ]
+            # Pickled caches are keyed by raw query and were always embedded with voyage-2.
+            if self.embedding_model == "voyage-2":
+                for query, embedding in json.loads(data["query_cache"]).items():
+                    self.query_cache.put(query, embedding)
+            # Pickles hold only rows: the lookup, posting lists and index are built from them.
+            self.row_lookup = {
+                chunk_key(item['doc_id'], item['original_index']): row for row, item in enumerate(self.metadata)
+            }
+            self.metadata_index = MetadataIndex()
+            self.metadata_index.add(self.metadata, 0)
+            index_state = None
+            quantization_state = None
+        else:
+            raise ValueError("Vector database file not found. Use load_data to create a new database.")
+        if index_state is not None and index_state["kind"] == self.index_type:
+            self.index = index_from_state(index_state)
+        else:
+            # Pickled databases, or a saved index of another type than the one asked for.
+            self._build_index()
+        if quantization_state is not None:
+            # The saved mode wins over the constructor's, so search matches what was built.
+            self.quantized = quantized_from_state(quantization_state)
+            self.quantization = self.quantized.kind
+        elif self.quantization is not None:
+            self._build_quantized()